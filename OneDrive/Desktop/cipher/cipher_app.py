@@ -7,12 +7,21 @@
 """
 
 import streamlit as st
+import hashlib
 import json
+import os
 import time
 import random
+import sys
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 from datetime import datetime
 
+# Code shared with cipher_game.py lives at the repo root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..")))
+from cipher_shared import AdaptiveConcurrencyLimiter, Hedger, SingleFlight, alias_key, quota_scheduler_from_env
+
 # ─────────────────────────────────────────────────────────────────────────────
 #  PAGE CONFIG  (must be first Streamlit call)
 # ─────────────────────────────────────────────────────────────────────────────
@@ -352,13 +361,122 @@ def leaderboard_row_html(rank, name, score, games, is_new=False):
 #  GEMINI API  (direct REST, no SDK needed)
 # ─────────────────────────────────────────────────────────────────────────────
 
-GEMINI_BASE = "https://generativelanguage.googleapis.com/v1beta/models"
+# Point CIPHER_GEMINI_BASE at fake_gemini.py (http://127.0.0.1:8089/v1beta/models) to run offline
+GEMINI_BASE = os.environ.get("CIPHER_GEMINI_BASE", "https://generativelanguage.googleapis.com/v1beta/models")
+
+HTTP_POOL_SIZE       = int(os.environ.get("CIPHER_HTTP_POOL_SIZE", 10))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("CIPHER_HTTP_CONNECT_TIMEOUT", 5))
+HTTP_READ_TIMEOUT    = float(os.environ.get("CIPHER_HTTP_READ_TIMEOUT", 30))
+
+REQUEST_BUDGET   = float(os.environ.get("CIPHER_REQUEST_BUDGET", 10))   # seconds a player will wait
+SECRET_BUDGET    = float(os.environ.get("CIPHER_SECRET_BUDGET", 30))    # concept generation at game start (no static fallback)
+RETRY_ATTEMPTS   = int(os.environ.get("CIPHER_RETRY_ATTEMPTS", 3))
+RETRY_BASE_DELAY = float(os.environ.get("CIPHER_RETRY_BASE_DELAY", 0.25))
+RETRY_MAX_DELAY  = 4.0
+
+
+class DeadlineExceededError(Exception):
+    """The player's latency budget ran out before Gemini answered."""
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+
+class GeminiHTTPClient:
+    """
+    Keep-alive connection pool shared by every Streamlit session and rerun,
+    so each question doesn't pay a fresh TCP+TLS handshake.
+    """
+
+    def __init__(self, pool_size=HTTP_POOL_SIZE, connect_timeout=HTTP_CONNECT_TIMEOUT,
+                 read_timeout=HTTP_READ_TIMEOUT):
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        self.session.headers.update({"Connection": "keep-alive"})
+        self.adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size,
+                                   pool_block=False, max_retries=0)
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self._lock = threading.Lock()
+        self.requests_sent = 0
+        self.total_latency = 0.0
+
+    def post(self, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        start = time.time()
+        try:
+            return self.session.post(url, **kwargs)
+        finally:
+            with self._lock:
+                self.requests_sent += 1
+                self.total_latency += time.time() - start
+
+    def stats(self):
+        """Requests sent vs. connections opened across all host pools."""
+        pool_map = self.adapter.poolmanager.pools
+        connections = sum(pool_map[key].num_connections for key in pool_map.keys())
+        with self._lock:
+            sent = self.requests_sent
+            avg_ms = (self.total_latency / sent * 1000) if sent else 0.0
+        return {
+            "requests": sent,
+            "connections_opened": connections,
+            "reuse_ratio": round(1 - connections / sent, 3) if sent else 0.0,
+            "avg_latency_ms": round(avg_ms, 1),
+        }
+
+
+@st.cache_resource
+def get_quota_scheduler(key_id: str):
+    """One scheduler per API key (keys have independent quotas), shared with cipher_game.py on this host."""
+    return quota_scheduler_from_env(key_id)
+
+
+@st.cache_resource
+def get_concurrency_limiter():
+    """Process-wide in-flight limit for Gemini, adapted from observed latency and 429/5xx."""
+    return AdaptiveConcurrencyLimiter(
+        initial=float(os.environ.get("CIPHER_AIMD_INITIAL", 4)),
+        min_limit=float(os.environ.get("CIPHER_AIMD_MIN", 1)),
+        max_limit=float(os.environ.get("CIPHER_AIMD_MAX", 32)),
+        latency_target=float(os.environ.get("CIPHER_AIMD_LATENCY_TARGET", 8)),
+    )
+
+
+@st.cache_resource
+def get_hedger():
+    """Opt-in (CIPHER_HEDGING=1) hedging for idempotent low-temperature calls; None when off."""
+    if os.environ.get("CIPHER_HEDGING") != "1":
+        return None
+    return Hedger(
+        budget=float(os.environ.get("CIPHER_HEDGE_BUDGET", 0.1)),
+        min_delay=float(os.environ.get("CIPHER_HEDGE_MIN_DELAY", 0.5)),
+    )
+
+
+@st.cache_resource
+def get_single_flight():
+    return SingleFlight()
+
+
+@st.cache_resource
+def get_http_client():
+    """One pooled client per process (cache_resource survives reruns and is shared across sessions)."""
+    return GeminiHTTPClient()
+
 
 def gemini_chat(api_key: str, model: str, messages: list, system: str = "",
-                temperature: float = 0.7, max_tokens: int = 512) -> str:
+                temperature: float = 0.7, max_tokens: int = 512,
+                priority: str = "interactive", hedge: bool = False, budget: float = None) -> str:
     """
     Call Gemini via raw REST with optimized token usage.
     messages: [{"role": "user"|"model", "parts": [{"text": "..."}]}]
+    priority: "interactive" when the player is waiting on it, "background" otherwise.
+    hedge: idempotent call that may be duplicated when slower than its rolling p95.
+    budget: seconds the caller will wait in total, retries included
+            (defaults to CIPHER_REQUEST_BUDGET for interactive calls, unbounded for background).
     """
     url = f"{GEMINI_BASE}/{model}:generateContent?key={api_key}"
 
@@ -373,11 +491,77 @@ def gemini_chat(api_key: str, model: str, messages: list, system: str = "",
     if system:
         payload["system_instruction"] = {"parts": [{"text": system}]}
 
-    try:
-        resp = requests.post(url, json=payload, timeout=30)
+    # Identical in-flight requests (same key, model and payload) share one call
+    flight_key = hashlib.sha256(
+        f"{api_key}|{model}|{json.dumps(payload, sort_keys=True)}".encode()
+    ).hexdigest()
+
+    if budget is None and priority == "interactive":
+        budget = REQUEST_BUDGET
+    deadline = time.time() + budget if budget is not None else None
+    quota = get_quota_scheduler(hashlib.sha256(api_key.encode()).hexdigest()[:12])
+    estimated = len(json.dumps(payload)) // 4 + max_tokens
+
+    def _attempt():
+        quota_wait = quota.background_max_wait if priority == "background" else quota.max_wait
+        read_timeout = HTTP_READ_TIMEOUT
+        if deadline is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise DeadlineExceededError("Latency budget spent before calling Gemini")
+            quota_wait = min(quota_wait, remaining)
+            read_timeout = min(read_timeout, remaining)
+        # Local concurrency slot before cross-process quota, so a call that never goes out spends no tokens
+        wait_start = time.time()
+        limiter = get_concurrency_limiter()
+        limiter.acquire(timeout=min(quota.max_wait, quota_wait))
+        try:
+            quota.acquire(estimated, priority=priority, max_wait=max(0.0, quota_wait - (time.time() - wait_start)))
+        except BaseException:
+            limiter.release(None, 0.0)
+            raise
+        if deadline is not None:
+            read_timeout = max(0.1, min(read_timeout, deadline - time.time()))
+        outcome, start = None, time.time()
+        try:
+            resp = get_http_client().post(url, json=payload, timeout=(HTTP_CONNECT_TIMEOUT, read_timeout))
+            if resp.status_code == 429 or resp.status_code >= 500:
+                outcome = "overload"
+            elif resp.ok:
+                outcome = "ok"
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+            outcome = "overload"
+            raise
+        finally:
+            limiter.release(outcome, time.time() - start)
+        return resp
+
+    def _post():
+        # Retry 429/503 only, with jittered backoff, while the budget allows another attempt
+        attempt = 0
+        while True:
+            resp = _attempt()
+            attempt += 1
+            if resp.status_code not in (429, 503) or attempt >= RETRY_ATTEMPTS:
+                break
+            delay = backoff_delay(attempt)
+            if deadline is not None and time.time() + delay >= deadline:
+                raise DeadlineExceededError(f"Latency budget spent after {attempt} attempt(s): HTTP {resp.status_code}")
+            time.sleep(delay)
         resp.raise_for_status()
         data = resp.json()
+        quota.settle(estimated, data.get("usageMetadata", {}).get("totalTokenCount", 0))
+        return data
+
+    try:
+        hedger = get_hedger() if hedge else None
+        if hedger is not None:
+            data = get_single_flight().do(flight_key, hedger.run, model, _post)
+        else:
+            data = get_single_flight().do(flight_key, _post)
         return data["candidates"][0]["content"]["parts"][0]["text"].strip()
+    except DeadlineExceededError as e:
+        return f"__ERROR__:Timed out: {str(e)}"
     except requests.exceptions.HTTPError as e:
         code = e.response.status_code if e.response else "?"
         body = e.response.text[:300] if e.response else ""
@@ -386,11 +570,13 @@ def gemini_chat(api_key: str, model: str, messages: list, system: str = "",
         return f"__ERROR__:{str(e)}"
 
 
-def gemini_json(api_key, model, prompt, system="", temperature=0.7, max_tokens=600):
+def gemini_json(api_key, model, prompt, system="", temperature=0.7, max_tokens=600,
+                priority="interactive", hedge=False, budget=None):
     """Gemini call expecting a clean JSON response with optimized token usage."""
     messages = [{"role": "user", "parts": [{"text": prompt}]}]
     raw = gemini_chat(api_key, model, messages, system=system,
-                      temperature=temperature, max_tokens=max_tokens)
+                      temperature=temperature, max_tokens=max_tokens, priority=priority,
+                      hedge=hedge, budget=budget)
     if raw.startswith("__ERROR__"):
         return None, raw
     # Strip markdown fences
@@ -465,9 +651,15 @@ Respond ONLY with valid JSON:
   "difficulty": "{difficulty}",
   "description": "<one sentence>",
   "fun_fact": "<one interesting fact>",
+  "aliases": ["<other names, abbreviations or spellings that mean exactly this subject>"],
   "optimal_first_questions": ["<Q1>","<Q2>","<Q3>","<Q4>","<Q5>"]
 }}"""
-    data, err = gemini_json(api_key, model, prompt, system=system, temperature=0.95, max_tokens=500)
+    data, err = gemini_json(api_key, model, prompt, system=system, temperature=0.95, max_tokens=560,
+                            budget=SECRET_BUDGET)
+    if data and "name" in data:
+        aliases = data.get("aliases") if isinstance(data.get("aliases"), list) else []
+        data["aliases"] = aliases
+        data["alias_keys"] = sorted({alias_key(a) for a in [data["name"]] + aliases if isinstance(a, str)} - {""})
     return data, err
 
 
@@ -490,7 +682,7 @@ Rules:
 Respond ONLY with valid JSON:
 {{"answer": "Yes"|"No"|"Irrelevant", "brief_reason": "<5 words max>"}}"""
 
-    data, err = gemini_json(api_key, model, prompt, system=system, temperature=0.1)
+    data, err = gemini_json(api_key, model, prompt, system=system, temperature=0.1, hedge=True)
     if data and "answer" in data:
         ans = data["answer"].strip()
         if ans not in ("Yes", "No", "Irrelevant"):
@@ -522,14 +714,20 @@ Generate 12 NEW strategic yes/no questions that:
 Respond ONLY with valid JSON:
 {{"questions": ["Q1","Q2","Q3","Q4","Q5","Q6","Q7","Q8","Q9","Q10","Q11","Q12"]}}"""
 
-    data, err = gemini_json(api_key, model, prompt, system=system, temperature=0.6)
+    data, err = gemini_json(api_key, model, prompt, system=system, temperature=0.6,
+                            priority="background")
     if data and "questions" in data:
         return data["questions"], None
     return [], err
 
 
-def validate_guess(api_key, model, secret_name, guess):
-    """Flexible guess validation via Gemini."""
+def validate_guess(api_key, model, secret_name, guess, alias_keys=None):
+    """Flexible guess validation: alias lookup first, Gemini only when that misses."""
+    key = alias_key(guess)
+    # A guess of only generic words ("the attack") normalizes to "" and matches nothing
+    if key and key in set(alias_keys or [alias_key(secret_name)]):
+        return True, "Matches an accepted name"
+
     system = """You are a fair judge for a guessing game. Validate answers considering exact matches, abbreviations, and alternate names."""
     
     prompt = f"""Secret: "{secret_name}"
@@ -540,7 +738,8 @@ Is this correct? Consider exact matches, abbreviations, alternate names, and par
 Respond ONLY with valid JSON:
 {{"correct": true|false, "reason": "<brief reason>"}}"""
 
-    data, err = gemini_json(api_key, model, prompt, system=system, temperature=0.1, max_tokens=150)
+    data, err = gemini_json(api_key, model, prompt, system=system, temperature=0.1, max_tokens=150,
+                            hedge=True)
     if data is not None:
         return bool(data.get("correct", False)), data.get("reason", "")
     return False, f"Validation error: {err}"
@@ -598,7 +797,8 @@ Respond ONLY with valid JSON:
   "strategy_tip": "<one sentence tip>"
 }}"""
 
-    data, err = gemini_json(api_key, model, prompt, system=system, temperature=0.3, max_tokens=700)
+    data, err = gemini_json(api_key, model, prompt, system=system, temperature=0.3, max_tokens=700,
+                            priority="background")
     return data, err
 
 
@@ -744,6 +944,16 @@ with st.sidebar:
     </div>
     """, unsafe_allow_html=True)
 
+    http_stats = get_http_client().stats()
+    st.markdown(f"""
+    <div style="font-family:'JetBrains Mono',monospace;font-size:0.58rem;
+                color:#1a3d5c;text-align:center;padding-top:4px">
+      HTTP · {http_stats['requests']} req · {http_stats['connections_opened']} conn ·
+      {http_stats['avg_latency_ms']}ms avg · {get_single_flight().followers} shared ·
+      limit {get_concurrency_limiter().stats()['limit']}
+    </div>
+    """, unsafe_allow_html=True)
+
 
 # ─────────────────────────────────────────────────────────────────────────────
 #  MAIN CONTENT — TABS
@@ -1083,7 +1293,8 @@ with tab_game:
         if submit_guess and guess_text:
             with st.spinner("🤖 Checking your answer..."):
                 correct, reason = validate_guess(
-                    S.api_key, S.gemini_model, secret["name"], guess_text
+                    S.api_key, S.gemini_model, secret["name"], guess_text,
+                    secret.get("alias_keys")
                 )
 
             if correct:
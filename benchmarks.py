@@ -0,0 +1,234 @@
+"""
+MICROBENCHMARKS FOR SERVER HOT PATHS
+
+Pins down the per-request CPU cost of the non-LLM work in cipher_game.py and
+flags regressions against a stored baseline.
+
+    python benchmarks.py --save          # record a baseline on this machine
+    python benchmarks.py                 # compare against it (exit 1 on regression)
+    python benchmarks.py -k leaderboard --threshold 0.1
+
+Gemini is replaced by the offline stand-in (fake_gemini.py), so nothing here
+touches the network.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+os.environ.setdefault('CIPHER_FAKE_GEMINI', '1')
+os.environ.setdefault('CIPHER_FAKE_LATENCY', 'fixed:0')
+os.environ.setdefault('CIPHER_CONCEPT_POOL', '0')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import cipher_game
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+
+QUESTIONS = [
+    "Is it malicious?", "Is it an attack?", "Does it involve computers?", "Is it defensive?",
+    "Does it require the internet?", "Is it a tool?", "Is it a protocol?", "Does it involve deception?",
+    "Does it target individuals?", "Is it automated?", "Did it exist before 2000?", "Is it illegal?",
+    "Is it widely known?", "Is it network based?", "Does it involve email?", "Is it related to encryption?",
+    "Was it created by a government?", "Does it spread on its own?", "Is it used by pentesters?"
+]
+
+def new_session(item: dict, asked: int = 0) -> dict:
+    session = {
+        "item": item,
+        "difficulty": "medium",
+        "questions_asked": 0,
+        "questions_log": [],
+        "asked_canonical": set(),
+        "hints_used": 0,
+        "hearts": 3,
+        "game_over": False,
+        "won": False,
+        "started_at": time.time(),
+        "wrong_guesses": 0
+    }
+    for question in QUESTIONS[:asked]:
+        cipher_game._record_answer(session, question, "No")
+    return session
+
+# ─────────────────────────────────────────────
+#  BENCHMARKS
+#  Each returns the zero-argument callable to time; setup stays outside the timing.
+# ─────────────────────────────────────────────
+
+def bench_session_id():
+    """get_session_id: md5 over remote address + User-Agent."""
+    req = SimpleNamespace(
+        remote_addr="203.0.113.7",
+        headers={"User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0"}
+    )
+    return lambda: cipher_game.get_session_id(req)
+
+def bench_duplicate_question():
+    """_check_question_request with 19 questions already asked (duplicate-question check included)."""
+    item = cipher_game.ITEMS['medium'][0]
+    headers = {"User-Agent": "bench-duplicate"}
+    ctx = cipher_game.app.test_request_context(
+        '/api/question', method='POST', json={"question_text": "Does it use quantum key exchange?"}, headers=headers
+    )
+    ctx.push()
+    cipher_game.sessions[cipher_game.get_session_id(cipher_game.request)] = new_session(item, asked=19)
+    cipher_game.request.get_json()
+    return cipher_game._check_question_request
+
+def bench_static_concept():
+    """_select_concept from a difficulty's static pool, with 5 concepts already recent."""
+    sid = "bench-select"
+    for _ in range(5):
+        cipher_game._select_concept('expert', False, sid)
+    return lambda: cipher_game._select_concept('expert', False, sid)
+
+def _leaderboard_bench(size: int):
+    item = cipher_game.ITEMS['medium'][0]
+    template = [{"name": f"player{i}", "score": (i * 37) % 150, "games": 1, "rank": 0} for i in range(size)]
+
+    def run():
+        cipher_game.LEADERBOARD[:] = template
+        cipher_game._apply_guess(new_session(item, asked=0), {"player_name": "bench"}, True)
+    return run
+
+def bench_leaderboard_100():
+    """_apply_guess on a win: LEADERBOARD append + sort + re-rank, 100 existing entries."""
+    return _leaderboard_bench(100)
+
+def bench_leaderboard_10000():
+    """Same with 10,000 existing entries (the leaderboard is never trimmed)."""
+    return _leaderboard_bench(10000)
+
+def bench_log_json():
+    """jsonify of the /api/question response once the log holds 19 entries."""
+    session = new_session(cipher_game.ITEMS['medium'][0], asked=19)
+    payload = {
+        "answer": "No",
+        "questions_asked": session['questions_asked'],
+        "questions_remaining": 20 - session['questions_asked'],
+        "log": session['questions_log']
+    }
+    ctx = cipher_game.app.app_context()
+    ctx.push()
+    return lambda: cipher_game.jsonify(payload).get_data()
+
+def bench_render_index():
+    """render_template_string(HTML_TEMPLATE), i.e. GET /."""
+    ctx = cipher_game.app.test_request_context('/')
+    ctx.push()
+    return lambda: cipher_game.render_template_string(cipher_game.HTML_TEMPLATE)
+
+BENCHMARKS = {
+    "session_id_md5": bench_session_id,
+    "duplicate_question_check": bench_duplicate_question,
+    "static_concept_select": bench_static_concept,
+    "leaderboard_append_sort_100": bench_leaderboard_100,
+    "leaderboard_append_sort_10000": bench_leaderboard_10000,
+    "log_json_serialize": bench_log_json,
+    "render_index_template": bench_render_index,
+}
+
+# ─────────────────────────────────────────────
+#  RUNNER
+# ─────────────────────────────────────────────
+
+def measure(fn, repeat: int = 15, min_run_time: float = 0.05) -> dict:
+    """Calibrate a loop count so each run takes ~min_run_time, then time `repeat` runs."""
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        if time.perf_counter() - start >= min_run_time:
+            break
+        loops *= 2
+    per_op = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        per_op.append((time.perf_counter() - start) / loops * 1e9)
+    return {
+        "median_ns": round(statistics.median(per_op), 1),
+        "min_ns": round(min(per_op), 1),
+        "loops": loops
+    }
+
+def compare(results: dict, baseline: dict, threshold: float) -> dict:
+    """
+    Ratio of each benchmark's best run to its baseline best run; above 1 + threshold
+    is a regression. The minimum is far less sensitive to scheduler noise than the median.
+    """
+    verdicts = {}
+    for name, result in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            verdicts[name] = {"status": "new"}
+            continue
+        ratio = result["min_ns"] / base["min_ns"] if base["min_ns"] else 1.0
+        status = "REGRESSION" if ratio > 1 + threshold else ("faster" if ratio < 1 - threshold else "ok")
+        verdicts[name] = {"status": status, "ratio": round(ratio, 3), "baseline_ns": base["min_ns"]}
+    return verdicts
+
+def format_ns(ns: float) -> str:
+    for unit, scale in (("s", 1e9), ("ms", 1e6), ("µs", 1e3)):
+        if ns >= scale:
+            return f"{ns / scale:.2f} {unit}"
+    return f"{ns:.0f} ns"
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks for cipher_game.py hot paths")
+    parser.add_argument('-k', dest='filter', default="", help="only run benchmarks whose name contains this")
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save', action='store_true', help="store these results as the new baseline")
+    parser.add_argument('--threshold', type=float, default=0.2, help="regression threshold (0.2 = 20%% slower)")
+    parser.add_argument('--repeat', type=int, default=15)
+    parser.add_argument('--json', metavar='FILE', help="also write results as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if args.filter in name:
+            results[name] = measure(setup(), repeat=args.repeat)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    verdicts = compare(results, baseline, args.threshold)
+
+    print(f"{'benchmark':<32}{'median':>12}{'min':>12}{'base min':>12}{'ratio':>8}  status")
+    print("─" * 86)
+    for name, result in results.items():
+        verdict = verdicts[name]
+        base = format_ns(verdict["baseline_ns"]) if "baseline_ns" in verdict else "-"
+        ratio = f"{verdict['ratio']:.2f}" if "ratio" in verdict else "-"
+        print(f"{name:<32}{format_ns(result['median_ns']):>12}{format_ns(result['min_ns']):>12}"
+              f"{base:>12}{ratio:>8}  {verdict['status']}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"results": results, "comparison": verdicts}, f, indent=2)
+    if args.save:
+        baseline_results = dict(baseline.get("results", {}), **results)
+        with open(args.baseline, 'w') as f:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "saved_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "results": baseline_results
+            }, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+
+    regressions = [name for name, v in verdicts.items() if v["status"] == "REGRESSION"]
+    if regressions and not args.save:
+        print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -6,28 +6,158 @@ Updated to use Gemini 2.5 Flash for intelligent question evaluation and guess va
 
 Uses:
 - Gemini 2.5 Flash for AI-powered question answering
-- AI-based guess validation (no more regex/fuzzy matching)
+- Local name/alias matching for clear-cut guesses, AI validation for the rest
 - Natural language question processing
 """
-from flask import Flask, jsonify, request, render_template_string
+from flask import Flask, Response, jsonify, request, render_template_string, stream_with_context
 import json
 import random
+import re
 import time
+import cProfile
 import hashlib
+import hmac
+import io
+import pstats
+import uuid
+import queue
+import tempfile
+import threading
+from collections import OrderedDict, deque
 from datetime import datetime
 import os
-import google.generativeai as genai
+import atexit
+import logging
+import logging.handlers
+import sys
+
+from cipher_shared import (AdaptiveConcurrencyLimiter, FlightCall, Hedger, SingleFlight, alias_key, guess_tokens,
+                           quota_scheduler_from_env)
+
+# ─────────────────────────────────────────────
+#  STRUCTURED LOGGING
+# ─────────────────────────────────────────────
+
+LOG_LEVEL = os.environ.get('CIPHER_LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('CIPHER_LOG_FORMAT', 'text')   # "text" or "json"
+
+def _parse_sample_rates(spec: str) -> dict:
+    """"ai_debug=0.01,guess_debug=0.1" -> {"ai_debug": 0.01, "guess_debug": 0.1}"""
+    rates = {}
+    for part in spec.split(','):
+        name, _, rate = part.partition('=')
+        if name.strip() and rate.strip():
+            rates[name.strip()] = float(rate)
+    return rates
+
+# Share of records kept per category (the rest are dropped on the calling thread, before formatting)
+LOG_SAMPLE_RATES = _parse_sample_rates(os.environ.get('CIPHER_LOG_SAMPLE', 'ai_debug=1,guess_debug=1'))
+
+class CategorySampler(logging.Filter):
+    def filter(self, record):
+        rate = LOG_SAMPLE_RATES.get(getattr(record, 'category', ''), 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+class TextFormatter(logging.Formatter):
+    """Keeps the familiar "[CATEGORY] message" shape."""
+
+    def format(self, record):
+        line = f"[{getattr(record, 'category', 'app').upper().replace('_', ' ')}] {record.getMessage()}"
+        fields = getattr(record, 'fields', None)
+        if fields:
+            line += " " + " ".join(f"{k}={v!r}" for k, v in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "category": getattr(record, 'category', 'app'),
+            "message": record.getMessage(),
+            "thread": record.threadName
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Never blocks the request thread: when the queue is full the record is dropped and counted."""
+
+    dropped = 0
+
+    def prepare(self, record):
+        # Only resolve the message here; tracebacks and formatting are left to the writer thread
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg, record.args = record.getMessage(), None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+LOGGER = logging.getLogger("cipher")
+LOGGER.setLevel(LOG_LEVEL)
+LOGGER.propagate = False
+_log_handler = DroppingQueueHandler(queue.Queue(maxsize=int(os.environ.get('CIPHER_LOG_QUEUE', 10000))))
+_log_handler.addFilter(CategorySampler())
+LOGGER.addHandler(_log_handler)
+
+# The only thread that touches stdout
+_log_output = logging.StreamHandler(sys.stdout)
+_log_output.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else TextFormatter())
+LOG_LISTENER = logging.handlers.QueueListener(_log_handler.queue, _log_output, respect_handler_level=False)
+LOG_LISTENER.start()
+atexit.register(LOG_LISTENER.stop)
+
+# State of the HTTP request being served by this thread: deadline, request ID, trace
+_request_context = threading.local()
+
+def log(level: int, category: str, message: str, *args, exc_info=False, **fields):
+    """Queue a log record; %-style args are only formatted if the level is enabled."""
+    if LOGGER.isEnabledFor(level):
+        request_id = getattr(_request_context, 'request_id', None)
+        if request_id:
+            fields.setdefault('request_id', request_id)
+        LOGGER.log(level, message, *args, exc_info=exc_info, extra={"category": category, "fields": fields})
+
+# CIPHER_CASSETTE=<file> records Gemini traffic to / replays it from a cassette (gemini_cassette.py)
+CASSETTE_FILE = os.environ.get('CIPHER_CASSETTE')
+CASSETTE_MODE = os.environ.get('CIPHER_CASSETTE_MODE', 'replay')
+
+# CIPHER_FAKE_GEMINI=1 swaps in the offline stand-in (fake_gemini.py) for load and latency testing;
+# replaying a cassette needs no real SDK either
+USE_FAKE_GEMINI = os.environ.get('CIPHER_FAKE_GEMINI') == '1' or bool(CASSETTE_FILE and CASSETTE_MODE == 'replay')
+if USE_FAKE_GEMINI:
+    import fake_gemini as genai
+else:
+    import google.generativeai as genai
 
 app = Flask(__name__)
 
 # Initialize Gemini API
-GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
+GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY') or ('fake-gemini-key' if USE_FAKE_GEMINI else None)
 if not GEMINI_API_KEY:
     raise ValueError("GEMINI_API_KEY environment variable is required!")
-print(f"[INIT] Using API key: {GEMINI_API_KEY[:20]}...")
+log(logging.INFO, "init", "Using API key: %s...", GEMINI_API_KEY[:20])
 genai.configure(api_key=GEMINI_API_KEY)
 gemini_model = genai.GenerativeModel('gemini-2.5-flash')
-print(f"[INIT] Gemini model initialized: gemini-2.5-flash")
+log(logging.INFO, "init", "Gemini model initialized: gemini-2.5-flash")
+
+GEMINI_CASSETTE = None
+if CASSETTE_FILE:
+    import gemini_cassette
+    GEMINI_CASSETTE = gemini_cassette.Cassette(CASSETTE_FILE)
+    gemini_model = gemini_cassette.wrap_model(
+        gemini_model, GEMINI_CASSETTE, CASSETTE_MODE, 'gemini-2.5-flash',
+        latency=os.environ.get('CIPHER_CASSETTE_LATENCY', 'recorded')
+    )
+    log(logging.INFO, "init", "Gemini cassette: %s %s", CASSETTE_MODE, CASSETTE_FILE)
 
 # ─────────────────────────────────────────────
 #  GAME KNOWLEDGE BASE
@@ -316,11 +446,1561 @@ QUESTION_HINTS = {
 # Active game sessions
 sessions = {}
 
+# ─────────────────────────────────────────────
+#  ANSWER CACHE
+# ─────────────────────────────────────────────
+
+class AnswerCache:
+    """
+    Process-wide LRU + TTL cache of AI answers, shared by all sessions.
+    Keys are (concept name, normalized question) tuples.
+    """
+
+    def __init__(self, max_size: int = 5000, ttl_seconds: float = 6 * 3600):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, stored_at = entry
+            if now - stored_at > self.ttl_seconds:
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.time())
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+ANSWER_CACHE = AnswerCache(
+    max_size=int(os.environ.get('CIPHER_ANSWER_CACHE_SIZE', 5000)),
+    ttl_seconds=float(os.environ.get('CIPHER_ANSWER_CACHE_TTL', 6 * 3600))
+)
+
+# ─────────────────────────────────────────────
+#  SINGLE-FLIGHT
+# ─────────────────────────────────────────────
+
+LLM_FLIGHTS = SingleFlight()
+
+# ─────────────────────────────────────────────
+#  GEMINI DISPATCH & CIRCUIT BREAKER
+# ─────────────────────────────────────────────
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling Gemini while the circuit is open."""
+
+class DegradedModeError(Exception):
+    """The local engine can't handle this request while Gemini is unavailable."""
+
+class CircuitBreaker:
+    """
+    Trips when the failure rate over the last `window` calls reaches
+    `failure_rate` (calls slower than `slow_seconds` count as failures).
+    After `cooldown` seconds one probe call is let through (half-open);
+    its outcome closes the circuit again or re-opens it.
+    """
+
+    def __init__(self, failure_rate: float = 0.5, slow_seconds: float = 10, window: int = 20,
+                 min_calls: int = 5, cooldown: float = 30):
+        self.failure_rate = failure_rate
+        self.slow_seconds = slow_seconds
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self._outcomes = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.times_opened = 0
+        self.rejected = 0
+
+    def before_call(self):
+        with self._lock:
+            if self.state == "closed":
+                return
+            if self.state == "open" and time.time() - self._opened_at >= self.cooldown:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+            self.rejected += 1
+        raise CircuitOpenError("Gemini circuit is open")
+
+    def abandon(self):
+        """The call admitted by before_call() never went out; free the half-open probe slot."""
+        with self._lock:
+            if self.state == "half_open":
+                self._probe_in_flight = False
+
+    def record(self, ok: bool, seconds: float):
+        ok = ok and seconds < self.slow_seconds
+        with self._lock:
+            if self.state == "half_open":
+                self._probe_in_flight = False
+                if ok:
+                    self.state = "closed"
+                    self._outcomes.clear()
+                    log(logging.WARNING, "circuit", "Probe succeeded, circuit closed")
+                else:
+                    self._trip()
+                return
+            self._outcomes.append(ok)
+            failures = self._outcomes.count(False)
+            if (self.state == "closed" and len(self._outcomes) >= self.min_calls
+                    and failures / len(self._outcomes) >= self.failure_rate):
+                self._trip()
+
+    def _trip(self):
+        self.state = "open"
+        self._opened_at = time.time()
+        self.times_opened += 1
+        log(logging.WARNING, "circuit", "Gemini circuit opened - serving from the local engine for %ss", self.cooldown)
+
+    def is_open(self) -> bool:
+        with self._lock:
+            return self.state == "open" and time.time() - self._opened_at < self.cooldown
+
+    def stats(self) -> dict:
+        with self._lock:
+            recent = len(self._outcomes)
+            return {
+                "state": self.state,
+                "recent_calls": recent,
+                "recent_failure_rate": round(self._outcomes.count(False) / recent, 3) if recent else 0.0,
+                "times_opened": self.times_opened,
+                "rejected_calls": self.rejected,
+                "seconds_since_opened": round(time.time() - self._opened_at, 1) if self._opened_at else None
+            }
+
+GEMINI_BREAKER = CircuitBreaker(
+    failure_rate=float(os.environ.get('CIPHER_CB_FAILURE_RATE', 0.5)),
+    slow_seconds=float(os.environ.get('CIPHER_CB_SLOW_SECONDS', 10)),
+    window=int(os.environ.get('CIPHER_CB_WINDOW', 20)),
+    min_calls=int(os.environ.get('CIPHER_CB_MIN_CALLS', 5)),
+    cooldown=float(os.environ.get('CIPHER_CB_COOLDOWN', 30))
+)
+
+# ─────────────────────────────────────────────
+#  QUOTA SCHEDULER
+# ─────────────────────────────────────────────
+
+GEMINI_QUOTA = quota_scheduler_from_env(hashlib.sha256(GEMINI_API_KEY.encode()).hexdigest()[:12])
+
+def estimate_tokens(prompt: str, generation_config: dict) -> int:
+    """Rough prompt size (~4 chars/token) plus the output budget."""
+    return len(prompt) // 4 + int(generation_config.get("max_output_tokens", 256))
+
+# ─────────────────────────────────────────────
+#  ADAPTIVE CONCURRENCY (AIMD)
+# ─────────────────────────────────────────────
+
+GEMINI_CONCURRENCY = AdaptiveConcurrencyLimiter(
+    initial=float(os.environ.get('CIPHER_AIMD_INITIAL', 8)),
+    min_limit=float(os.environ.get('CIPHER_AIMD_MIN', 1)),
+    max_limit=float(os.environ.get('CIPHER_AIMD_MAX', 64)),
+    latency_target=float(os.environ.get('CIPHER_AIMD_LATENCY_TARGET', 8))
+)
+
+OVERLOAD_ERRORS = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+                   "DeadlineExceeded", "GatewayTimeout", "BadGateway", "Timeout", "TimeoutError"}
+
+def is_overload_error(error: Exception) -> bool:
+    """429 / 5xx / timeouts - the signals that Gemini wants less traffic."""
+    code = getattr(error, 'code', None)
+    return (isinstance(code, int) and (code == 429 or code >= 500)) or type(error).__name__ in OVERLOAD_ERRORS
+
+# ─────────────────────────────────────────────
+#  METRICS (Prometheus text exposition at /metrics)
+# ─────────────────────────────────────────────
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+TOKEN_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+class Metrics:
+    """
+    Counters and histograms with a lock-free hot path: recording is one
+    deque.append (atomic in CPython). Pending events are folded into the
+    totals at scrape time, or by whichever thread first sees the buffer
+    past `max_pending` and wins a non-blocking try-lock.
+    """
+
+    def __init__(self, max_pending: int = 10000):
+        self.max_pending = max_pending
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._meta = {}
+        self._values = {}
+
+    def counter(self, name: str, help_text: str):
+        self._meta[name] = ("counter", help_text, None)
+
+    def histogram(self, name: str, help_text: str, buckets: tuple = LATENCY_BUCKETS):
+        self._meta[name] = ("histogram", help_text, buckets)
+
+    def inc(self, name: str, labels: tuple = (), value: float = 1):
+        self._pending.append((name, labels, value))
+        if len(self._pending) > self.max_pending:
+            self._try_fold()
+
+    observe = inc
+
+    def _try_fold(self):
+        if self._lock.acquire(blocking=False):
+            try:
+                self._fold()
+            finally:
+                self._lock.release()
+
+    def _fold(self):
+        while True:
+            try:
+                name, labels, value = self._pending.popleft()
+            except IndexError:
+                return
+            kind, _, buckets = self._meta[name]
+            key = (name, labels)
+            if kind == "counter":
+                self._values[key] = self._values.get(key, 0) + value
+                continue
+            hist = self._values.get(key)
+            if hist is None:
+                hist = self._values[key] = [0] * len(buckets) + [0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    hist[i] += 1
+            hist[-2] += value
+            hist[-1] += 1
+
+    def render(self, snapshots: list = ()) -> str:
+        """Text exposition format; `snapshots` are (name, type, help, [(labels, value)]) read at scrape time."""
+        with self._lock:
+            self._fold()
+            values = dict(self._values)
+        lines = []
+        for name, (kind, help_text, buckets) in self._meta.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for (metric, labels), value in sorted(values.items()):
+                if metric != name:
+                    continue
+                if kind == "counter":
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+                    continue
+                for bound, count in zip(buckets, value):
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', str(bound)),))} {count}")
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {value[-1]}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {round(value[-2], 6)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {value[-1]}")
+        for name, kind, help_text, samples in snapshots:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            lines += [f"{name}{_format_labels(labels)} {value}" for labels, value in samples]
+        return "\n".join(lines) + "\n"
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+METRICS = Metrics()
+METRICS.histogram("cipher_http_request_duration_seconds", "HTTP request latency by route, method and status.")
+METRICS.histogram("cipher_gemini_call_duration_seconds", "Gemini call latency by call site and outcome.")
+METRICS.histogram("cipher_gemini_output_tokens", "Output tokens per Gemini call by call site.", TOKEN_BUCKETS)
+METRICS.counter("cipher_gemini_output_tokens_total", "Gemini output tokens by call site.")
+METRICS.counter("cipher_gemini_prompt_tokens_total", "Gemini prompt tokens by call site.")
+
+# ─────────────────────────────────────────────
+#  TRACING
+# ─────────────────────────────────────────────
+
+TRACE_FILE = os.environ.get('CIPHER_TRACE_FILE')                       # unset = tracing off
+TRACE_SLOW_MS = float(os.environ.get('CIPHER_TRACE_SLOW_MS', 500))     # always keep traces slower than this
+TRACE_SAMPLE = float(os.environ.get('CIPHER_TRACE_SAMPLE', 0))         # share of faster traces kept anyway
+
+class Span:
+    """One timed stage of a request; nests under whatever span was open when it started."""
+
+    __slots__ = ("trace", "name", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, trace, name: str, parent_id, attributes: dict):
+        self.trace = trace
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.error = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        self.trace.finish(self)
+        return False
+
+class _NoopSpan:
+    attributes = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NOOP_SPAN = _NoopSpan()
+
+class Trace:
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.spans = []
+        self._stack = []
+
+    def start(self, name: str, attributes: dict) -> Span:
+        span = Span(self, name, self._stack[-1].span_id if self._stack else None, attributes)
+        self.spans.append(span)
+        self._stack.append(span)
+        return span
+
+    def finish(self, span: Span):
+        span.end_ns = time.time_ns()
+        if span in self._stack:
+            self._stack.remove(span)
+
+    def current(self):
+        return self._stack[-1] if self._stack else None
+
+def span(name: str, **attributes):
+    """Context manager timing one stage of the current request (a shared no-op when not tracing)."""
+    trace = getattr(_request_context, 'trace', None)
+    return trace.start(name, attributes) if trace is not None else NOOP_SPAN
+
+def annotate(**attributes):
+    """Attach attributes to the innermost open span of the current request, if traced."""
+    trace = getattr(_request_context, 'trace', None)
+    current = trace.current() if trace is not None else None
+    if current is not None:
+        current.attributes.update(attributes)
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+class TraceExporter:
+    """
+    Writes kept traces to disk as OTLP/JSON, one ExportTraceServiceRequest
+    per line, from a background thread. Traces are dropped rather than
+    queued without bound if the writer falls behind.
+    """
+
+    def __init__(self, path: str, max_pending: int = 1000):
+        self.path = path
+        self._queue = queue.Queue(maxsize=max_pending)
+        self.exported = 0
+        self.sampled_out = 0
+        self.dropped = 0
+        threading.Thread(target=self._run, daemon=True, name="trace-exporter").start()
+
+    def offer(self, trace: Trace, duration_ms: float):
+        """Slow-request sampler: keep every trace over TRACE_SLOW_MS, and TRACE_SAMPLE of the rest."""
+        if duration_ms < TRACE_SLOW_MS and random.random() >= TRACE_SAMPLE:
+            self.sampled_out += 1
+            return
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            trace = self._queue.get()
+            try:
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps(self.to_otlp(trace), separators=(',', ':')) + "\n")
+                self.exported += 1
+            except OSError as e:
+                log(logging.WARNING, "tracing", "Could not write %s: %s", self.path, e)
+
+    @staticmethod
+    def to_otlp(trace: Trace) -> dict:
+        spans = []
+        for s in trace.spans:
+            entry = {
+                "traceId": trace.trace_id,
+                "spanId": s.span_id,
+                "name": s.name,
+                "kind": 2 if s.parent_id is None else 1,   # SERVER for the root, INTERNAL below it
+                "startTimeUnixNano": str(s.start_ns),
+                "endTimeUnixNano": str(s.end_ns or s.start_ns),
+                "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attributes.items()],
+                "status": {"code": 2, "message": s.error} if s.error else {"code": 1}
+            }
+            if s.parent_id:
+                entry["parentSpanId"] = s.parent_id
+            spans.append(entry)
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "cipher-game"}}]},
+            "scopeSpans": [{"scope": {"name": "cipher_game"}, "spans": spans}]
+        }]}
+
+    def stats(self) -> dict:
+        return {
+            "file": self.path,
+            "slow_ms": TRACE_SLOW_MS,
+            "sample": TRACE_SAMPLE,
+            "exported": self.exported,
+            "sampled_out": self.sampled_out,
+            "dropped": self.dropped
+        }
+
+TRACE_EXPORTER = TraceExporter(TRACE_FILE) if TRACE_FILE else None
+
+# ─────────────────────────────────────────────
+#  ON-DEMAND PROFILING
+# ─────────────────────────────────────────────
+
+# Admin routes and the X-Profile header need X-Admin-Token to match (unset = admin features off)
+ADMIN_TOKEN = os.environ.get('CIPHER_ADMIN_TOKEN')
+PROFILE_DIR = os.environ.get('CIPHER_PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'cipher_profiles'))
+PROFILE_SAMPLE = float(os.environ.get('CIPHER_PROFILE_SAMPLE', 0))   # share of requests profiled unasked
+PROFILE_KEEP = int(os.environ.get('CIPHER_PROFILE_KEEP', 200))       # newest captures kept on disk
+
+PROFILE_NAME = re.compile(
+    r'^(?P<captured_at>\d{8}T\d{6})_(?P<method>[A-Z]+)_(?P<route>[\w.-]*)_(?P<status>\d{3})'
+    r'_(?P<latency_ms>\d+)ms_(?P<request_id>[\w.-]+)\.pstats$'
+)
+
+def admin_authorized(token) -> bool:
+    return bool(ADMIN_TOKEN and token) and hmac.compare_digest(token, ADMIN_TOKEN)
+
+class _ProfiledBody:
+    """Keeps the profiler running while the body is iterated, so streamed responses are covered."""
+
+    def __init__(self, body, on_close):
+        self._body = body
+        self._on_close = on_close
+
+    def __iter__(self):
+        return iter(self._body)
+
+    def close(self):
+        try:
+            if hasattr(self._body, 'close'):
+                self._body.close()
+        finally:
+            self._on_close()
+
+class RequestProfiler:
+    """
+    WSGI middleware that runs flagged requests under cProfile and saves a
+    .pstats file per request, named after its method, route, status, latency
+    and request ID. A request is flagged by an `X-Profile: 1` header carrying a
+    valid X-Admin-Token, or at random with probability CIPHER_PROFILE_SAMPLE.
+    Unflagged requests pass straight through.
+
+    What a capture covers depends on the Python version. Up to 3.11 (what
+    runtime.txt deploys) cProfile hooks only the thread that enables it, so
+    work the request hands to other threads (batched questions, hedges) is
+    missing. From 3.12 it records every thread in the process, so under load
+    a capture also holds other requests' and background threads' work - read
+    it as the process over the request's lifetime, not the request alone.
+    Only one request is captured at a time (3.12+ allows one active profiler
+    per process); flagged requests that arrive meanwhile run unprofiled.
+    """
+
+    def __init__(self, wsgi_app, url_map, directory: str, sample: float, keep: int):
+        self.wsgi_app = wsgi_app
+        self.url_map = url_map
+        self.directory = directory
+        self.sample = sample
+        self.keep = keep
+        self._lock = threading.Lock()
+        self.captured = 0
+        self.skipped_busy = 0
+
+    def __call__(self, environ, start_response):
+        if not self._flagged(environ):
+            return self.wsgi_app(environ, start_response)
+        if not self._lock.acquire(blocking=False):
+            self.skipped_busy += 1
+            return self.wsgi_app(environ, start_response)
+
+        meta = {"status": "000", "request_id": ""}
+
+        def capture_start_response(status, headers, exc_info=None):
+            meta["status"] = status.split(' ', 1)[0]
+            meta["request_id"] = next((v for k, v in headers if k.lower() == 'x-request-id'), "")
+            return start_response(status, headers, exc_info)
+
+        profiler = cProfile.Profile()
+        started = time.time()
+        profiler.enable()
+        try:
+            body = self.wsgi_app(environ, capture_start_response)
+        except BaseException:
+            profiler.disable()
+            self._lock.release()
+            raise
+
+        def finish():
+            profiler.disable()
+            try:
+                self._save(profiler, environ, meta, started, time.time() - started)
+            finally:
+                self._lock.release()
+        return _ProfiledBody(body, finish)
+
+    def _flagged(self, environ) -> bool:
+        if self.sample and random.random() < self.sample:
+            return True
+        return environ.get('HTTP_X_PROFILE') == '1' and admin_authorized(environ.get('HTTP_X_ADMIN_TOKEN'))
+
+    def _route(self, environ) -> str:
+        try:
+            rule, _ = self.url_map.bind_to_environ(environ).match(return_rule=True)
+            return rule.rule
+        except Exception:
+            return "unmatched"
+
+    def _save(self, profiler, environ, meta: dict, started: float, seconds: float):
+        route = re.sub(r'[^\w.-]+', '-', self._route(environ)).strip('-') or "root"
+        request_id = re.sub(r'[^\w.-]+', '', meta["request_id"]) or uuid.uuid4().hex
+        name = (f"{time.strftime('%Y%m%dT%H%M%S', time.localtime(started))}_{environ.get('REQUEST_METHOD', 'GET')}"
+                f"_{route}_{meta['status']}_{int(seconds * 1000)}ms_{request_id[:32]}.pstats")
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            profiler.dump_stats(os.path.join(self.directory, name))
+            self.captured += 1
+            self._prune()
+        except OSError as e:
+            log(logging.WARNING, "profiling", "Could not save %s: %s", name, e)
+            return
+        log(logging.INFO, "profiling", "Saved profile %s", name)
+
+    def _prune(self):
+        names = sorted(n for n in os.listdir(self.directory) if PROFILE_NAME.match(n))
+        for stale in names[:max(0, len(names) - self.keep)]:
+            os.remove(os.path.join(self.directory, stale))
+
+    def captures(self) -> list:
+        """Saved captures, newest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for name in sorted(os.listdir(self.directory), reverse=True):
+            match = PROFILE_NAME.match(name)
+            if match:
+                entry = match.groupdict()
+                entry["name"] = name
+                entry["status"] = int(entry["status"])
+                entry["latency_ms"] = int(entry["latency_ms"])
+                entry["bytes"] = os.path.getsize(os.path.join(self.directory, name))
+                entries.append(entry)
+        return entries
+
+    def stats(self) -> dict:
+        return {
+            "directory": self.directory,
+            "sample": self.sample,
+            "captured": self.captured,
+            "skipped_busy": self.skipped_busy
+        }
+
+# ─────────────────────────────────────────────
+#  SAMPLING PROFILER (opt-in)
+# ─────────────────────────────────────────────
+
+SAMPLER_HZ = float(os.environ.get('CIPHER_SAMPLER_HZ', 0))                  # stack samples per second; 0 = off
+SAMPLER_MAX_STACKS = int(os.environ.get('CIPHER_SAMPLER_MAX_STACKS', 20000))  # distinct stacks kept
+
+# Leaf frames of a thread that is blocked rather than burning CPU (idle workers, sockets, locks).
+# Blocking C calls (time.sleep, gRPC, the HTTP read inside generate_content) have no frame of
+# their own, so those waits are marked explicitly with waiting_on() instead.
+IDLE_LEAVES = {
+    ("threading.py", "wait"), ("threading.py", "join"), ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"), ("socket.py", "readinto"), ("socket.py", "accept"), ("ssl.py", "read"),
+    ("ssl.py", "recv_into"), ("socketserver.py", "serve_forever"), ("queue.py", "get"), ("thread.py", "_worker")
+}
+
+# thread ident -> what it is blocked on, while inside a waiting_on() block
+WAITING_THREADS = {}
+
+class waiting_on:
+    """Marks the current thread as blocked (on Gemini, a backoff, ...) for the sampling profiler."""
+
+    __slots__ = ("reason", "ident")
+
+    def __init__(self, reason: str):
+        self.reason = reason
+
+    def __enter__(self):
+        self.ident = threading.get_ident()
+        WAITING_THREADS[self.ident] = self.reason
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        WAITING_THREADS.pop(self.ident, None)
+        return False
+
+def _thread_cpu_ns(native_id):
+    """Nanoseconds a thread has spent on CPU (Linux), or None where that can't be read."""
+    try:
+        with open(f"/proc/self/task/{native_id}/schedstat") as f:
+            return int(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+
+class SamplingProfiler:
+    """
+    Background thread that snapshots every thread's Python stack via
+    sys._current_frames() and counts collapsed stacks
+    ("thread;outer;...;leaf" -> samples). Cost is one stack walk per thread
+    per tick and nothing on the request path, so it can stay on at a few Hz.
+
+    Each sample is also classed as busy or idle. A thread is idle if it is
+    inside waiting_on(), parked in one of IDLE_LEAVES, or (on Linux) used
+    almost no CPU since the previous tick. Marked waits get a "[wait: reason]"
+    leaf so they stay visible in the full graph.
+    """
+
+    def __init__(self, hz: float, max_stacks: int):
+        self.interval = 1.0 / hz
+        self.hz = hz
+        self.max_stacks = max_stacks
+        self._lock = threading.Lock()
+        self._stacks = {}
+        self._labels = {}
+        self._since = time.time()
+        self.samples = 0
+        self.truncated = 0
+        self.busy_seconds = 0.0
+        self._cpu_ns = {}
+        self._thread = threading.Thread(target=self._run, daemon=True, name="sampling-profiler")
+        self._thread.start()
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            self._labels[code] = label
+        return label
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            start = time.perf_counter()
+            threads = {t.ident: t for t in threading.enumerate()}
+            cpu_ns = {}
+            collapsed = []
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                thread = threads.get(ident)
+                idle = self._idle_on_cpu(ident, thread, cpu_ns)
+                reason = WAITING_THREADS.get(ident)
+                leaf = (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+                stack = [f"[wait: {reason}]"] if reason else []
+                while frame is not None:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(re.sub(r'\d+', 'N', thread.name) if thread else "unknown")
+                collapsed.append((";".join(reversed(stack)), idle or bool(reason) or leaf in IDLE_LEAVES))
+            self._cpu_ns = cpu_ns
+            with self._lock:
+                for key in collapsed:
+                    if key in self._stacks:
+                        self._stacks[key] += 1
+                    elif len(self._stacks) < self.max_stacks:
+                        self._stacks[key] = 1
+                    else:
+                        self.truncated += 1
+                self.samples += 1
+                self.busy_seconds += time.perf_counter() - start
+
+    def _idle_on_cpu(self, ident, thread, cpu_ns: dict) -> bool:
+        """True if the thread used under 1% of a tick's CPU since the last sample."""
+        now = _thread_cpu_ns(getattr(thread, 'native_id', None)) if thread else None
+        if now is None:
+            return False
+        cpu_ns[ident] = now
+        last = self._cpu_ns.get(ident)
+        return last is not None and now - last < self.interval * 1e7
+
+    def collapsed(self, include_idle: bool = True) -> dict:
+        with self._lock:
+            items = list(self._stacks.items())
+        stacks = {}
+        for (stack, idle), count in items:
+            if include_idle or not idle:
+                stacks[stack] = stacks.get(stack, 0) + count
+        return stacks
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self._since = time.time()
+            self.samples = 0
+            self.truncated = 0
+            self.busy_seconds = 0.0
+
+    def stats(self) -> dict:
+        with self._lock:
+            elapsed = max(time.time() - self._since, 1e-9)
+            return {
+                "hz": self.hz,
+                "window_s": round(elapsed, 1),
+                "samples": self.samples,
+                "distinct_stacks": len(self._stacks),
+                "truncated": self.truncated,
+                "overhead_pct": round(self.busy_seconds / elapsed * 100, 3)
+            }
+
+def render_flamegraph(stacks: dict, title: str, width: int = 1200) -> str:
+    """Self-contained SVG flame graph (root at the bottom) from collapsed stacks."""
+    root = {"count": 0, "children": {}}
+    for stack, count in stacks.items():
+        root["count"] += count
+        node = root
+        for frame in stack.split(';'):
+            node = node["children"].setdefault(frame, {"count": 0, "children": {}})
+            node["count"] += count
+
+    def depth_of(node):
+        return 1 + max((depth_of(c) for c in node["children"].values()), default=0)
+
+    row, pad_top, pad_bottom = 16, 30, 10
+    depth = depth_of(root) - 1
+    height = pad_top + depth * row + pad_bottom
+    total = root["count"] or 1
+    scale = (width - 20) / total
+    rects = []
+
+    def layout(node, x, level):
+        for name, child in sorted(node["children"].items()):
+            w = child["count"] * scale
+            if w >= 0.5:
+                y = height - pad_bottom - (level + 1) * row
+                digest = hashlib.md5(name.encode()).digest()
+                color = f"rgb({205 + digest[0] % 50},{80 + digest[1] % 120},{digest[2] % 60})"
+                pct = child["count"] / total * 100
+                tooltip = _xml_escape(f"{name} ({child['count']} samples, {pct:.2f}%)")
+                label = _xml_escape(name[:int(w / 7)] if w > 35 else "")
+                rects.append(
+                    f'<g><title>{tooltip}</title><rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{row - 1}" '
+                    f'fill="{color}" rx="2"/><text x="{x + 3:.1f}" y="{y + 11}">{label}</text></g>'
+                )
+                layout(child, x, level + 1)
+            x += w
+
+    layout(root, 10, 0)
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'style="font-family:monospace;font-size:11px">'
+        f'<rect width="100%" height="100%" fill="#fdfdf6"/>'
+        f'<text x="10" y="20" style="font-size:14px">{_xml_escape(title)}</text>'
+        + "".join(rects) + '</svg>'
+    )
+
+def _xml_escape(text: str) -> str:
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
+
+SAMPLING_PROFILER = SamplingProfiler(SAMPLER_HZ, SAMPLER_MAX_STACKS) if SAMPLER_HZ > 0 else None
+
+# ─────────────────────────────────────────────
+#  REQUEST DEADLINES & RETRIES
+# ─────────────────────────────────────────────
+
+class DeadlineExceededError(Exception):
+    """The request's latency budget ran out before Gemini answered."""
+
+REQUEST_BUDGET = float(os.environ.get('CIPHER_REQUEST_BUDGET', 10))   # seconds a player will wait
+GEMINI_TIMEOUT = float(os.environ.get('CIPHER_GEMINI_TIMEOUT', 30))   # per-call cap off the request path
+RETRY_ATTEMPTS = int(os.environ.get('CIPHER_RETRY_ATTEMPTS', 3))
+RETRY_BASE_DELAY = float(os.environ.get('CIPHER_RETRY_BASE_DELAY', 0.25))
+RETRY_MAX_DELAY = 4.0
+
+# Only "slow down" answers are worth retrying; anything else fails the same way twice
+RETRYABLE_ERRORS = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable"}
+
+def set_request_deadline(deadline):
+    _request_context.deadline = deadline
+
+def current_deadline():
+    return getattr(_request_context, 'deadline', None)
+
+def is_retryable_error(error: Exception) -> bool:
+    """429 and 503 only."""
+    code = getattr(error, 'code', None)
+    return code in (429, 503) or type(error).__name__ in RETRYABLE_ERRORS
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+RETRY_COUNTS = {"retries": 0, "gave_up": 0, "deadline_exceeded": 0}
+
+# ─────────────────────────────────────────────
+#  HEDGED REQUESTS (opt-in)
+# ─────────────────────────────────────────────
+
+GEMINI_HEDGER = Hedger(
+    budget=float(os.environ.get('CIPHER_HEDGE_BUDGET', 0.1)),
+    min_delay=float(os.environ.get('CIPHER_HEDGE_MIN_DELAY', 0.5))
+) if os.environ.get('CIPHER_HEDGING') == '1' else None
+
+def call_gemini(call_site: str, prompt: str, generation_config: dict, priority: str = "interactive",
+                hedge: bool = False, **kwargs):
+    """
+    Single entry point for every Gemini request, so cross-cutting policy
+    (circuit breaking, quota, concurrency, ...) lives in one place. `call_site` names the caller;
+    `priority` is "interactive" when a player is waiting, "background" otherwise.
+    `hedge` marks idempotent low-temperature calls that may be duplicated when slow.
+    Calls on a request thread never outlive that request's latency budget.
+    """
+    # Read on the caller's thread - a hedge runs on a pool thread
+    deadline = current_deadline()
+    with span("gemini.generate_content", call_site=call_site, priority=priority, stream=bool(kwargs.get('stream'))):
+        if hedge and GEMINI_HEDGER is not None and not kwargs.get('stream'):
+            return GEMINI_HEDGER.run(
+                call_site, lambda: _call_gemini_with_retry(call_site, prompt, generation_config, priority, deadline, **kwargs)
+            )
+        return _call_gemini_with_retry(call_site, prompt, generation_config, priority, deadline, **kwargs)
+
+def _call_gemini_with_retry(call_site: str, prompt: str, generation_config: dict, priority: str, deadline, **kwargs):
+    """Retry 429/503 with jittered exponential backoff while the deadline allows another attempt."""
+    attempt = 0
+    while True:
+        try:
+            return _call_gemini_once(call_site, prompt, generation_config, priority, deadline, **kwargs)
+        except DeadlineExceededError:
+            _count_path("deadline_exceeded", RETRY_COUNTS)
+            raise
+        except Exception as e:
+            attempt += 1
+            if not is_retryable_error(e) or attempt >= RETRY_ATTEMPTS:
+                raise
+            delay = backoff_delay(attempt)
+            if deadline is not None and time.time() + delay >= deadline:
+                _count_path("gave_up", RETRY_COUNTS)
+                raise DeadlineExceededError(f"Latency budget spent after {attempt} attempt(s): {str(e)}") from e
+            _count_path("retries", RETRY_COUNTS)
+            log(logging.INFO, "retry", "%s attempt %d failed (%s), retrying in %.2fs",
+                call_site, attempt, type(e).__name__, delay)
+            with waiting_on("backoff"):
+                time.sleep(delay)
+
+def _call_gemini_once(call_site: str, prompt: str, generation_config: dict, priority: str, deadline=None, **kwargs):
+    if GEMINI_BREAKER.is_open():
+        raise CircuitOpenError("Gemini circuit is open")
+    
+    quota_wait = GEMINI_QUOTA.background_max_wait if priority == "background" else GEMINI_QUOTA.max_wait
+    timeout = GEMINI_TIMEOUT
+    start_wait = time.time()
+    if deadline is not None:
+        remaining = deadline - start_wait
+        if remaining <= 0:
+            raise DeadlineExceededError("Latency budget spent before calling Gemini")
+        quota_wait = min(quota_wait, remaining)
+        timeout = min(timeout, remaining)
+    
+    # Cheapest rejection first: the breaker, then a local concurrency slot, and only then
+    # cross-process quota, so a call that never goes out doesn't spend shared tokens
+    estimated = estimate_tokens(prompt, generation_config)
+    GEMINI_BREAKER.before_call()
+    try:
+        GEMINI_CONCURRENCY.acquire(timeout=min(GEMINI_QUOTA.max_wait, quota_wait))
+    except BaseException:
+        GEMINI_BREAKER.abandon()
+        raise
+    try:
+        GEMINI_QUOTA.acquire(estimated, priority=priority, max_wait=max(0.0, quota_wait - (time.time() - start_wait)))
+    except BaseException:
+        GEMINI_CONCURRENCY.release(None, 0.0)
+        GEMINI_BREAKER.abandon()
+        raise
+    if deadline is not None:
+        timeout = max(0.1, min(timeout, deadline - time.time()))
+    
+    start = time.time()
+    try:
+        with waiting_on("gemini"):
+            response = gemini_model.generate_content(
+                prompt, generation_config=generation_config, request_options={"timeout": timeout}, **kwargs
+            )
+    except BaseException as e:
+        _finish_gemini_call(call_site, "error", time.time() - start, e)
+        raise
+    if kwargs.get('stream'):
+        # Not over until the body has been read: the stream keeps the slot and records the outcome
+        return GeminiStream(response, call_site, estimated, start)
+    _finish_gemini_call(call_site, "ok", time.time() - start)
+    _record_usage(call_site, estimated, getattr(response, 'usage_metadata', None))
+    return response
+
+def _finish_gemini_call(call_site: str, result: str, elapsed: float, error: BaseException = None):
+    """
+    Report a finished call to the breaker, the AIMD limiter and the latency
+    histogram, and free its concurrency slot. result: "ok", "error", or
+    "abandoned" for a stream closed before anything arrived (no verdict on Gemini).
+    """
+    try:
+        if result == "abandoned":
+            GEMINI_BREAKER.abandon()
+        else:
+            GEMINI_BREAKER.record(result == "ok", elapsed)
+            METRICS.observe("cipher_gemini_call_duration_seconds", (("call_site", call_site), ("outcome", result)), elapsed)
+    finally:
+        if result == "ok":
+            GEMINI_CONCURRENCY.release("ok", elapsed)
+        else:
+            GEMINI_CONCURRENCY.release("overload" if error is not None and is_overload_error(error) else None, elapsed)
+
+def _record_usage(call_site: str, estimated: int, usage):
+    if usage is None:
+        return
+    GEMINI_QUOTA.settle(estimated, getattr(usage, 'total_token_count', 0))
+    output_tokens = getattr(usage, 'candidates_token_count', 0) or 0
+    METRICS.observe("cipher_gemini_output_tokens", (("call_site", call_site),), output_tokens)
+    METRICS.inc("cipher_gemini_output_tokens_total", (("call_site", call_site),), output_tokens)
+    METRICS.inc("cipher_gemini_prompt_tokens_total", (("call_site", call_site),),
+                getattr(usage, 'prompt_token_count', 0) or 0)
+
+class GeminiStream:
+    """
+    A streamed Gemini response that holds its concurrency slot until the body
+    is done, so the breaker and the AIMD limiter see the whole call. Reading
+    to the end, or closing early once the caller has what it needs, counts as
+    success; an error mid-body counts as a failed call.
+    """
+
+    def __init__(self, response, call_site: str, estimated: int, start: float):
+        self._response = response
+        self.call_site = call_site
+        self.estimated = estimated
+        self.start = start
+        self.chunks = 0
+        self._finished = False
+
+    def __iter__(self):
+        try:
+            chunks = iter(self._response)
+            while True:
+                with waiting_on("gemini"):
+                    chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                self.chunks += 1
+                yield chunk
+        except Exception as e:
+            self._finish("error", e)
+            raise
+        else:
+            self._finish("ok")
+            _record_usage(self.call_site, self.estimated, getattr(self._response, 'usage_metadata', None))
+        finally:
+            self.close()
+
+    def close(self):
+        self._finish("ok" if self.chunks else "abandoned")
+        close_response = getattr(self._response, 'close', None)
+        if close_response is not None:
+            close_response()
+
+    def _finish(self, result: str, error: BaseException = None):
+        if not self._finished:
+            self._finished = True
+            _finish_gemini_call(self.call_site, result, time.time() - self.start, error)
+
+    def __del__(self):
+        # Safety net: a stream dropped without being read or closed must not leak its slot
+        self.close()
+
+# ─────────────────────────────────────────────
+#  QUESTION CANONICALIZATION
+# ─────────────────────────────────────────────
+
+CONTRACTIONS = {
+    "isn't": "is not", "aren't": "are not", "wasn't": "was not", "weren't": "were not",
+    "doesn't": "does not", "don't": "do not", "didn't": "did not", "can't": "can not",
+    "cannot": "can not", "won't": "will not", "wouldn't": "would not", "shouldn't": "should not",
+    "couldn't": "could not", "hasn't": "has not", "haven't": "have not",
+    "it's": "it is", "that's": "that is", "what's": "what is", "there's": "there is"
+}
+
+# Multi-word spellings of a single term, joined into one token before tokenizing
+QUESTION_PHRASES = {
+    "artificial intelligence": "ai",
+    "machine learning": "ml",
+    "e-mail": "email",
+    "cyber attack": "cyberattack",
+    "cyber-attack": "cyberattack",
+    "state sponsored": "state-sponsored",
+    "nation state": "nation-state",
+    "well known": "well-known",
+    "self executing": "self-executing"
+}
+
+# Spelling variants only (plurals are handled by stem_word); every word maps to the first entry.
+# Anything looser would let one question take another's cached answer or "already asked" slot.
+QUESTION_SYNONYMS = [
+    ["defense", "defence"],
+    ["organization", "organisation"],
+    ["online", "on-line"]
+]
+
+# Filler that never changes what is being asked. Verbs ("use", "involve", "can") and
+# prepositions ("by", "in", "about") stay: "used in attacks" is not "an attack".
+QUESTION_STOPWORDS = {
+    "is", "it", "its", "a", "an", "the", "this", "that", "does", "do", "did", "are", "was",
+    "were", "be", "been", "being", "or", "and", "any", "some", "kind", "type", "sort", "thing",
+    "something", "considered", "typically", "usually", "generally", "primarily", "mainly", "often",
+    "really", "actually", "basically", "classified", "you", "i", "me", "say"
+}
+
+def _word_pattern(words) -> re.Pattern:
+    """Alternation matching whole words only, longest first."""
+    return re.compile(r"(?<![\w'-])(" + "|".join(map(re.escape, sorted(words, key=len, reverse=True))) + r")(?![\w'-])")
+
+_CONTRACTION_RE = _word_pattern(CONTRACTIONS)
+_PHRASE_RE = _word_pattern(QUESTION_PHRASES)
+
+def stem_word(word: str) -> str:
+    """Very small suffix stripper - consistency matters more than linguistic accuracy."""
+    if len(word) <= 4 or '-' in word:
+        return word
+    if word.endswith(("sses", "xes", "zes", "ches", "shes")):
+        return word[:-2]
+    if word.endswith(("ss", "us", "is")):
+        return word
+    for suffix, replacement in (("ies", "y"), ("ing", ""), ("ed", ""), ("ly", ""), ("s", "")):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)] + replacement
+    return word
+
+def _build_synonym_index() -> dict:
+    index = {}
+    for group in QUESTION_SYNONYMS:
+        canonical = stem_word(group[0])
+        for word in group:
+            if ' ' not in word:
+                index[stem_word(word)] = canonical
+    return index
+
+SYNONYM_INDEX = _build_synonym_index()
+_TOKEN_RE = re.compile(r"[a-z0-9][a-z0-9\-']*")
+
+def canonicalize_question(question: str) -> str:
+    """
+    Reduce a question to a canonical key so paraphrases share cache entries
+    and count as duplicates.
+
+    "IS IT MALICIOUS??", "is this malicious" and "Is it malicious?" all map to "malicious".
+    Negations are kept, so "isn't it malicious" stays distinct ("not malicious"), and so
+    are verbs and prepositions: "Is it used in attacks?" is "used in attack", not "attack".
+    """
+    text = question.lower().replace('\u2019', "'")
+    text = _CONTRACTION_RE.sub(lambda m: CONTRACTIONS[m.group(1)], text)
+    text = _PHRASE_RE.sub(lambda m: QUESTION_PHRASES[m.group(1)], text)
+    
+    tokens = []
+    for word in _TOKEN_RE.findall(text):
+        word = word.strip("'-")
+        if not word or word in QUESTION_STOPWORDS:
+            continue
+        word = SYNONYM_INDEX.get(stem_word(word), stem_word(word))
+        if tokens and tokens[-1] == word:
+            continue
+        tokens.append(word)
+    
+    if not tokens:
+        # Nothing meaningful left - fall back to plain normalization
+        return ' '.join(question.lower().split()).rstrip('?!. ')
+    return ' '.join(tokens)
+
 def get_session_id(request):
     ip = request.remote_addr or "127.0.0.1"
     ua = request.headers.get('User-Agent', '')
     return hashlib.md5(f"{ip}{ua}".encode()).hexdigest()[:16]
 
+# ─────────────────────────────────────────────
+#  FACT FAST PATH
+# ─────────────────────────────────────────────
+
+# Curated phrasings per fact key (canonicalized at startup, like the QUESTION_HINTS text).
+# A question is answered from the fact table only when its whole canonical form is one of these.
+FACT_TRIGGERS = {
+    "is_a_concept": ["concept", "abstract concept", "idea", "abstract idea"],
+    "is_physical": ["physical", "have physical form", "physical object", "physical device", "hardware"],
+    "is_a_person": ["person", "real person", "human"],
+    "involves_computers": ["involve computers", "use computers", "related to computers"],
+    "is_malicious": ["malicious", "harmful", "malicious software", "harmful or malicious"],
+    "is_defensive": ["defensive", "defensive tool", "defensive measure", "used for defense", "used for protection"],
+    "requires_internet": ["require internet", "need internet", "require internet connection",
+                          "need internet connection", "require network connection"],
+    "involves_human_error": ["exploit human error", "involve human error", "exploit human psychology"],
+    "is_automated": ["automated", "self-executing"],
+    "predates_2000": ["exist before 2000", "exist before year 2000", "created before 2000", "older than 2000"],
+    "is_illegal": ["illegal"],
+    "is_widely_known": ["widely known", "well-known", "commonly known", "known to public"],
+    "is_a_protocol": ["protocol", "network protocol"],
+    "is_a_tool": ["tool", "software tool", "security tool"],
+    "involves_deception": ["involve deception", "deceptive", "involve impersonation"],
+    "targets_individuals": ["target individuals", "target people"],
+    "targets_organizations": ["target organizations", "target companies", "target businesses"],
+    "is_an_attack": ["attack", "cyberattack", "attack technique", "type of attack"],
+    "is_network_based": ["network-based", "network based", "operate over network", "operate over internet"],
+    "involves_email": ["involve email", "use email", "spread through email", "spread via email"],
+    "is_state_sponsored": ["state-sponsored", "government backed", "government-backed"],
+    "targets_infrastructure": ["target infrastructure", "target critical infrastructure"],
+    "involves_ai": ["involve ai", "use ai"],
+    "involves_ml": ["involve ml", "use ml"],
+    "is_research_topic": ["research topic", "active research topic"]
+}
+
+def _build_fact_index() -> dict:
+    index = {}
+    for fact_key, phrases in FACT_TRIGGERS.items():
+        for phrase in phrases + [QUESTION_HINTS.get(fact_key, '')]:
+            canonical = canonicalize_question(phrase) if phrase else ''
+            if canonical:
+                index.setdefault(canonical, fact_key)
+    return index
+
+FACT_INDEX = _build_fact_index()
+
+def match_fact(canonical: str):
+    """Fact key whose trigger is exactly this canonical question, or None."""
+    return FACT_INDEX.get(canonical)
+
+QUESTION_PATH_COUNTS = {"cache": 0, "facts": 0, "llm": 0, "degraded": 0}
+_path_counts_lock = threading.Lock()
+
+def _count_path(path: str, counts: dict = QUESTION_PATH_COUNTS):
+    with _path_counts_lock:
+        counts[path] += 1
+    annotate(path=path)
+
+def resolve_answer(question: str, item: dict, llm=None) -> str:
+    """
+    Answer a question via the cheapest path that can do so confidently:
+    answer cache, then the concept's fact table, then Gemini (via `llm`).
+    """
+    canonical = canonicalize_question(question)
+    cached = ANSWER_CACHE.get((item['name'], canonical))
+    if cached is not None:
+        _count_path("cache")
+        return cached
+    
+    fact_key = match_fact(canonical)
+    if fact_key:
+        value = item.get('facts', {}).get(fact_key)
+        if isinstance(value, bool):
+            _count_path("facts")
+            return "Yes" if value else "No"
+    
+    if not GEMINI_BREAKER.is_open():
+        _count_path("llm")
+        try:
+            with span("llm"):
+                return LLM_FLIGHTS.do(("question", item['name'], canonical), llm or evaluate_question, question, item)
+        except Exception as e:
+            log(logging.WARNING, "degraded", "Question fell back to local engine: %s", e)
+    
+    # Gemini unavailable: only fact-table questions can be answered; refuse the rest without charging a question
+    _count_path("degraded")
+    raise DegradedModeError(
+        "The AI is temporarily unavailable, so only basic property questions can be answered "
+        "(e.g. \"Is it malicious?\"). This question was not counted."
+    )
+
+# ─────────────────────────────────────────────
+#  LOCAL GUESS MATCHER
+# ─────────────────────────────────────────────
+
+GUESS_ACCEPT_RATIO = float(os.environ.get('CIPHER_GUESS_ACCEPT_RATIO', 0.85))
+GUESS_REJECT_RATIO = float(os.environ.get('CIPHER_GUESS_REJECT_RATIO', 0.5))
+
+GUESS_PATH_COUNTS = {"local_correct": 0, "local_wrong": 0, "llm": 0, "degraded": 0}
+
+def edit_distance(a: str, b: str) -> int:
+    """Levenshtein distance with a rolling row."""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+def similarity_ratio(a: str, b: str) -> float:
+    if not a or not b:
+        return 0.0
+    return 1 - edit_distance(a, b) / max(len(a), len(b))
+
+def _fuzzy_token_overlap(guess: list, target: list) -> float:
+    """Token-set similarity where near-identical tokens (typos) count as equal."""
+    if not guess or not target:
+        return 0.0
+    unmatched = list(target)
+    shared = 0
+    for token in set(guess):
+        for candidate in unmatched:
+            if token == candidate or (len(token) >= 5 and similarity_ratio(token, candidate) >= 0.8):
+                unmatched.remove(candidate)
+                shared += 1
+                break
+    return shared / (len(set(guess)) + len(set(target)) - shared)
+
+def match_guess_locally(guess: str, item: dict):
+    """
+    Decide clear-cut guesses without the LLM.
+
+    Returns True (clearly correct), False (clearly wrong) or None when the
+    guess falls in the ambiguous band and should go to validate_guess_with_ai.
+    """
+    aliases = item.get('aliases') or CONCEPT_ALIASES.get(item['name'], [])
+    g_tokens = guess_tokens(guess)
+    if not g_tokens:
+        # Only generic words - right only when that is the concept's literal name ("Malware")
+        raw = re.sub(r"[^a-z0-9]", "", guess.lower())
+        if raw and raw in {re.sub(r"[^a-z0-9]", "", c.lower()) for c in [item['name']] + list(aliases)}:
+            return True
+        return None
+    g_joined = ''.join(g_tokens)
+    if g_joined in ALIAS_INDEX.get(item['name'], ()):
+        return True
+    
+    best_overlap = 0.0
+    best_ratio = 0.0
+    for candidate in [item['name']] + list(aliases):
+        c_tokens = guess_tokens(candidate)
+        if not c_tokens:
+            continue
+        c_joined = ''.join(c_tokens)
+        if g_joined == c_joined:
+            return True
+        ratio = similarity_ratio(g_joined, c_joined)
+        if ratio >= GUESS_ACCEPT_RATIO and len(c_joined) >= 5:
+            return True
+        best_ratio = max(best_ratio, ratio)
+        best_overlap = max(best_overlap, _fuzzy_token_overlap(g_tokens, c_tokens))
+    
+    # Without aliases a synonym ("packet filter" for Firewall) shares nothing with the name
+    if aliases and best_overlap == 0.0 and best_ratio < GUESS_REJECT_RATIO:
+        return False
+    return None
+
+def check_guess(guess: str, item: dict, llm=None) -> bool:
+    """Resolve clear guesses locally; only the ambiguous middle band reaches Gemini."""
+    local = match_guess_locally(guess, item)
+    if local is True:
+        _count_path("local_correct", GUESS_PATH_COUNTS)
+        return True
+    if local is False:
+        _count_path("local_wrong", GUESS_PATH_COUNTS)
+        return False
+    
+    if not GEMINI_BREAKER.is_open():
+        _count_path("llm", GUESS_PATH_COUNTS)
+        try:
+            with span("llm"):
+                return LLM_FLIGHTS.do(("guess", item['name'], alias_key(guess)), llm or validate_guess_with_ai, guess, item)
+        except Exception as e:
+            log(logging.WARNING, "guess_error", "AI validation failed: %s", e)
+    
+    # Ambiguous guess and no AI to settle it - don't take a heart for it
+    _count_path("degraded", GUESS_PATH_COUNTS)
+    raise DegradedModeError(
+        "The AI is temporarily unavailable and this guess is too close to call offline. "
+        "Try the concept's full name - no heart was lost."
+    )
+
+# ─────────────────────────────────────────────
+#  CONCEPT ALIASES
+# ─────────────────────────────────────────────
+
+ALIAS_FILE = os.environ.get(
+    'CIPHER_ALIAS_FILE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'concept_aliases.json')
+)
+
+ALIAS_MAX_GENERATED = int(os.environ.get('CIPHER_ALIAS_MAX_AI', 500))   # AI-concept entries kept (oldest dropped)
+ALIAS_SAVE_DELAY = 2.0   # seconds; registrations inside this window share one file write
+
+# concept name -> accepted alternative names, and concept name -> set of normalized alias keys
+CONCEPT_ALIASES = {}
+ALIAS_INDEX = {}
+_alias_lock = threading.Lock()
+_alias_save_pending = threading.Event()
+_alias_background = {"loader": None, "writer": None}
+
+def _static_concept_names() -> set:
+    return {item['name'] for items in ITEMS.values() for item in items}
+
+def register_aliases(name: str, aliases: list, persist: bool = True):
+    """
+    Index a concept's accepted names so guess checks become a set lookup.
+    Persisting only schedules a write; the file is rewritten off the request path.
+    """
+    aliases = sorted({a.strip() for a in aliases if isinstance(a, str) and a.strip()})
+    keys = {alias_key(a) for a in [name] + aliases}
+    keys.discard('')
+    with _alias_lock:
+        CONCEPT_ALIASES.pop(name, None)
+        CONCEPT_ALIASES[name] = aliases
+        ALIAS_INDEX[name] = keys
+        _trim_generated_aliases()
+    if persist:
+        schedule_alias_save()
+
+def _trim_generated_aliases():
+    """Drop the oldest AI-concept entries beyond ALIAS_MAX_GENERATED; static concepts always stay."""
+    static = _static_concept_names()
+    generated = [name for name in CONCEPT_ALIASES if name not in static]
+    for name in generated[:max(0, len(generated) - ALIAS_MAX_GENERATED)]:
+        del CONCEPT_ALIASES[name]
+        ALIAS_INDEX.pop(name, None)
+
+def schedule_alias_save():
+    _alias_save_pending.set()
+    with _alias_lock:
+        if _alias_background["writer"] is None:
+            _alias_background["writer"] = threading.Thread(target=_alias_writer, daemon=True, name="alias-writer")
+            _alias_background["writer"].start()
+
+def _alias_writer():
+    while True:
+        _alias_save_pending.wait()
+        time.sleep(ALIAS_SAVE_DELAY)
+        _alias_save_pending.clear()
+        save_alias_file()
+
+def flush_alias_file():
+    if _alias_save_pending.is_set():
+        _alias_save_pending.clear()
+        save_alias_file()
+
+atexit.register(flush_alias_file)
+
+def load_alias_file():
+    try:
+        with open(ALIAS_FILE) as f:
+            stored = json.load(f)
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        log(logging.WARNING, "aliases", "Could not read %s: %s", ALIAS_FILE, e)
+        return
+    for name, aliases in stored.items():
+        register_aliases(name, aliases, persist=False)
+    log(logging.INFO, "aliases", "Loaded aliases for %d concepts", len(stored))
+
+def save_alias_file():
+    with _alias_lock:
+        snapshot = dict(CONCEPT_ALIASES)
+    try:
+        tmp_path = ALIAS_FILE + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f, indent=2)   # insertion order = age, for trimming after a reload
+        os.replace(tmp_path, ALIAS_FILE)
+    except Exception as e:
+        log(logging.WARNING, "aliases", "Could not write %s: %s", ALIAS_FILE, e)
+
+def generate_aliases_with_ai(names: list) -> dict:
+    """Ask Gemini for accepted alternative names of several concepts in one call."""
+    prompt = f"""For each cybersecurity concept below, list the alternative names a player could
+reasonably type as a correct guess: abbreviations, acronyms, expansions, common spellings
+and well-known synonyms.
+
+Only include names that unambiguously refer to that exact concept.
+Do NOT include broader categories (e.g. "malware" for "Ransomware") or related-but-different concepts.
+
+CONCEPTS:
+{json.dumps(names)}
+
+OUTPUT FORMAT (JSON object mapping each concept name to a list of aliases):
+{{"Concept Name": ["Alias 1", "Alias 2"]}}
+
+Return ONLY valid JSON, no markdown, no explanations."""
+
+    response = call_gemini(
+        "aliases",
+        prompt,
+        generation_config={
+            "temperature": 0.2,
+            "max_output_tokens": 60 * len(names) + 100,
+        },
+        priority="background"
+    )
+    text = response.text.strip()
+    if '```json' in text:
+        text = text.split('```json')[1].split('```')[0].strip()
+    elif '```' in text:
+        text = text.split('```')[1].split('```')[0].strip()
+    result = json.loads(text)
+    return {name: result.get(name, []) for name in names if isinstance(result.get(name, []), list)}
+
+def ensure_static_aliases():
+    """Load stored aliases and generate any missing ones for ITEMS in a single batched call."""
+    load_alias_file()
+    names = [item['name'] for items in ITEMS.values() for item in items]
+    missing = [name for name in names if name not in CONCEPT_ALIASES]
+    if missing:
+        try:
+            log(logging.INFO, "aliases", "Generating aliases for %d concepts", len(missing))
+            generated = generate_aliases_with_ai(missing)
+            for name, aliases in generated.items():
+                register_aliases(name, aliases, persist=False)
+            save_alias_file()
+        except Exception as e:
+            log(logging.ERROR, "aliases_error", "Alias generation failed: %s", e)
+    for items in ITEMS.values():
+        for item in items:
+            item['aliases'] = CONCEPT_ALIASES.get(item['name'], [])
+
+def start_alias_loader():
+    """Runs ensure_static_aliases once per process; guesses fall back to name matching until it finishes."""
+    if _alias_background["loader"] is not None:
+        return
+    with _alias_lock:
+        if _alias_background["loader"] is None:
+            _alias_background["loader"] = threading.Thread(target=ensure_static_aliases, daemon=True, name="alias-loader")
+            _alias_background["loader"].start()
+
+@app.before_request
+def start_background_work():
+    """Started with the first request (or by __main__), so merely importing the module calls no API."""
+    start_alias_loader()
+
+@app.before_request
+def start_request_deadline():
+    """Every request gets a latency budget; a client may ask for less via X-Latency-Budget-Ms."""
+    budget = REQUEST_BUDGET
+    header = request.headers.get('X-Latency-Budget-Ms')
+    if header:
+        try:
+            budget = min(budget, max(0.0, float(header) / 1000))
+        except ValueError:
+            pass
+    _request_context.started_at = time.time()
+    set_request_deadline(_request_context.started_at + budget)
+
+@app.before_request
+def start_request_trace():
+    """Tag the request with an ID (the caller's X-Request-ID if sent) and open its root span."""
+    request_id = request.headers.get('X-Request-ID', '')
+    if not re.fullmatch(r'[\w.-]{1,64}', request_id):
+        request_id = uuid.uuid4().hex
+    _request_context.request_id = request_id
+    if TRACE_EXPORTER is not None:
+        # Always a fresh trace ID: callers may reuse X-Request-ID, and a shared trace ID would
+        # merge separate requests into one trace. The request ID is kept as an attribute.
+        trace = Trace(uuid.uuid4().hex)
+        trace.start(f"{request.method} {request.path}", {
+            "http.method": request.method, "http.target": request.path, "http.request_id": request_id
+        })
+        _request_context.trace = trace
+
+@app.after_request
+def finish_request_trace(response):
+    """Ends the root span once the response is closed, so streamed responses are timed in full."""
+    response.headers['X-Request-ID'] = _request_context.request_id
+    trace = getattr(_request_context, 'trace', None)
+    if trace is not None and trace.spans:
+        root = trace.spans[0]
+        root.attributes["http.route"] = request.url_rule.rule if request.url_rule else "unmatched"
+        root.attributes["http.status_code"] = response.status_code
+
+        def export():
+            trace.finish(root)
+            _request_context.trace = None
+            TRACE_EXPORTER.offer(trace, (root.end_ns - root.start_ns) / 1e6)
+        response.call_on_close(export)
+    return response
+
+@app.after_request
+def record_request_metrics(response):
+    """Observed when the response is closed, so streamed (SSE) responses count their full duration."""
+    start = getattr(_request_context, 'started_at', None)
+    if start is not None:
+        labels = (
+            ("route", request.url_rule.rule if request.url_rule else "unmatched"),
+            ("method", request.method),
+            ("status", str(response.status_code))
+        )
+        response.call_on_close(
+            lambda: METRICS.observe("cipher_http_request_duration_seconds", labels, time.time() - start)
+        )
+    return response
+
+@app.teardown_request
+def clear_request_deadline(error=None):
+    set_request_deadline(None)
+    _request_context.request_id = None
+
+@app.after_request
+def record_interaction(response):
+    """In cassette record mode, log each API request so the game stream can be replayed."""
+    if GEMINI_CASSETTE is None or CASSETTE_MODE != 'record' or not request.path.startswith('/api/'):
+        return response
+    entry = {
+        "kind": "http",
+        "method": request.method,
+        "path": request.path,
+        "body": request.get_json(silent=True),
+        "user_agent": request.headers.get('User-Agent', ''),
+        "remote_addr": request.remote_addr,
+        "status": response.status_code
+    }
+    if request.path == '/api/start' and response.status_code == 200:
+        entry["concept"] = sessions.get(get_session_id(request), {}).get('item')
+    GEMINI_CASSETTE.record(entry)
+    return response
+
 @app.route('/')
 def index():
     return render_template_string(HTML_TEMPLATE)
@@ -335,9 +2015,38 @@ def start_game():
     use_ai = data.get('use_ai', False)  # Default to static mode for stability
     sid = get_session_id(request)
     
+    with span("select_concept", mode='ai' if use_ai else 'static'):
+        item = _select_concept(difficulty, use_ai, sid)
+    
+    log(logging.INFO, "session", "Selected '%s', Mode: %s", item['name'], 'AI' if use_ai else 'Static', session=sid)
+    
+    with span("session_create"):
+        sessions[sid] = {
+            "item": item,
+            "difficulty": difficulty,
+            "questions_asked": 0,
+            "questions_log": [],
+            "asked_canonical": set(),
+            "hints_used": 0,
+            "hearts": 3,
+            "game_over": False,
+            "won": False,
+            "started_at": time.time(),
+            "wrong_guesses": 0
+        }
+    
+    return jsonify({
+        "status": "ok",
+        "session_id": sid,
+        "difficulty": difficulty,
+        "category_hint": item["category"].replace("_", " ").title(),
+        "questions_remaining": 20
+    })
+
+def _select_concept(difficulty: str, use_ai: bool, sid: str) -> dict:
     if use_ai:
-        # Generate a unique concept using AI
-        item = generate_concept_with_ai(difficulty, sid)
+        # Pre-generated AI concept (generated inline if the pool is empty)
+        item = take_ai_concept(difficulty, sid)
     else:
         # Use static pool (limited variety)
         items = ITEMS.get(difficulty, ITEMS['hard'])
@@ -355,7 +2064,7 @@ def start_game():
         if not available_items:
             recent_concepts[sid] = []
             available_items = items
-            print(f"Session {sid}: All concepts used, resetting recent list")
+            log(logging.INFO, "session", "All concepts used, resetting recent list", session=sid)
         
         # Select a random concept from available ones
         item = random.choice(available_items)
@@ -364,53 +2073,64 @@ def start_game():
         recent_concepts[sid].append(item['name'])
         if len(recent_concepts[sid]) > 5:
             recent_concepts[sid].pop(0)
-    
-    print(f"Session {sid}: Selected '{item['name']}', Mode: {'AI' if use_ai else 'Static'}")
-    
-    sessions[sid] = {
-        "item": item,
-        "difficulty": difficulty,
-        "questions_asked": 0,
-        "questions_log": [],
-        "hints_used": 0,
-        "hearts": 3,
-        "game_over": False,
-        "won": False,
-        "started_at": time.time(),
-        "wrong_guesses": 0
-    }
-    
-    return jsonify({
-        "status": "ok",
-        "session_id": sid,
-        "difficulty": difficulty,
-        "category_hint": item["category"].replace("_", " ").title(),
-        "questions_remaining": 20
-    })
+    return item
+
 
 def generate_concept_with_ai(difficulty: str, session_id: str) -> dict:
     """
     Generate a unique cybersecurity concept using AI.
     Ensures no repetition by tracking globally used concepts.
     """
-    # Track globally used concepts (not just per session)
-    if not hasattr(generate_concept_with_ai, 'used_concepts'):
-        generate_concept_with_ai.used_concepts = set()
-    
     # Get recently used concepts for this session
     if session_id not in recent_concepts:
         recent_concepts[session_id] = []
     
     recent = recent_concepts[session_id]
     
+    try:
+        concept = request_concept_from_ai(difficulty, recent[-20:])
+        track_concept(session_id, concept['name'])
+        return concept
+    
+    except Exception as e:
+        log(logging.ERROR, "ai_concept_error", "Failed to generate concept: %s", e,
+            exc_info=not isinstance(e, CircuitOpenError))
+        
+        # Fallback to static pool with better selection
+        items = ITEMS.get(difficulty, ITEMS['hard'])
+        available = [item for item in items if item['name'] not in recent]
+        if not available:
+            available = items
+        selected = random.choice(available)
+        log(logging.INFO, "ai_concept", "Using fallback: %s", selected['name'])
+        return selected
+
+def track_concept(session_id: str, name: str):
+    """Remember a served AI concept globally and in the session's recent list."""
+    if not hasattr(generate_concept_with_ai, 'used_concepts'):
+        generate_concept_with_ai.used_concepts = set()
+    generate_concept_with_ai.used_concepts.add(name)
+    recent = recent_concepts.setdefault(session_id, [])
+    recent.append(name)
+    if len(recent) > 20:
+        recent.pop(0)
+
+MAX_CONCEPT_EXCLUSIONS = 20   # names listed in the prompt, to avoid huge prompts
+
+def request_concept_from_ai(difficulty: str, exclusions: list, priority: str = "interactive") -> dict:
+    """
+    Make one Gemini call for a new concept. Raises on any failure so callers
+    can decide how to fall back. Only the last MAX_CONCEPT_EXCLUSIONS names of
+    `exclusions` are sent, so callers put the ones that matter most last.
+    """
     difficulty_descriptions = {
         "medium": "well-known cybersecurity concepts like common attacks, basic security tools, or widely recognized threats",
         "hard": "advanced cybersecurity concepts like specific malware families, historical cyber events, or specialized security frameworks",
         "expert": "cutting-edge cybersecurity topics like AI security, quantum cryptography, advanced persistent threats, or emerging research areas"
     }
     
-    # Build exclusion list (limit to last 20 to avoid huge prompts)
-    recent_exclusions = list(set(recent[-20:]))
+    # Deduplicated in order, so the same exclusions always give the same prompt
+    recent_exclusions = list(dict.fromkeys(exclusions))[-MAX_CONCEPT_EXCLUSIONS:]
     exclusion_text = f"\n\nDO NOT USE these recently used concepts: {', '.join(recent_exclusions)}" if recent_exclusions else ""
     
     prompt = f"""Generate a unique cybersecurity concept for a guessing game.
@@ -422,13 +2142,15 @@ REQUIREMENTS:
 1. Must be a real cybersecurity concept, attack, tool, defense, or technology
 2. Must be appropriate for {difficulty} difficulty level
 3. Must be interesting and educational
-4. Must have clear yes/no answerable properties{exclusion_text}
+4. Must have clear yes/no answerable properties
+5. "aliases" lists other names that unambiguously refer to this exact concept (may be empty){exclusion_text}
 
 OUTPUT FORMAT (JSON):
 {{
     "name": "Concept Name",
     "category": "cybersecurity",
     "description": "Brief 1-sentence description",
+    "aliases": ["Abbreviation", "Alternative name"],
     "facts": {{
         "is_a_concept": true,
         "is_physical": false,
@@ -454,57 +2176,157 @@ OUTPUT FORMAT (JSON):
 
 Return ONLY valid JSON, no markdown, no explanations."""
 
-    try:
-        print(f"[AI CONCEPT] Generating concept for difficulty: {difficulty}")
-        response = gemini_model.generate_content(
-            prompt,
-            generation_config={
-                "temperature": 1.0,  # Higher for more variety
-                "max_output_tokens": 500,
-            }
-        )
-        
-        if response and hasattr(response, 'text') and response.text:
-            # Extract JSON from response
-            text = response.text.strip()
-            print(f"[AI CONCEPT] Raw response: {text[:200]}...")
-            
-            # Remove markdown code blocks if present
-            if '```json' in text:
-                text = text.split('```json')[1].split('```')[0].strip()
-            elif '```' in text:
-                text = text.split('```')[1].split('```')[0].strip()
-            
-            concept = json.loads(text)
-            
-            # Validate required fields
-            if 'name' not in concept or 'category' not in concept or 'description' not in concept:
-                raise ValueError("Missing required fields in generated concept")
+    log(logging.INFO, "ai_concept", "Generating concept for difficulty: %s", difficulty)
+    response = call_gemini(
+        "concept",
+        prompt,
+        generation_config={
+            "temperature": 1.0,  # Higher for more variety
+            "max_output_tokens": 560,
+        },
+        priority=priority
+    )
+    
+    if not (response and hasattr(response, 'text') and response.text):
+        raise Exception("No response from AI")
+    
+    # Extract JSON from response
+    text = response.text.strip()
+    log(logging.DEBUG, "ai_concept", "Raw response: %s...", text[:200])
+    
+    # Remove markdown code blocks if present
+    if '```json' in text:
+        text = text.split('```json')[1].split('```')[0].strip()
+    elif '```' in text:
+        text = text.split('```')[1].split('```')[0].strip()
+    
+    concept = json.loads(text)
+    
+    # Validate required fields
+    if 'name' not in concept or 'category' not in concept or 'description' not in concept:
+        raise ValueError("Missing required fields in generated concept")
+    
+    # Index accepted names once, at creation time
+    aliases = concept.get('aliases')
+    register_aliases(concept['name'], aliases if isinstance(aliases, list) else [])
+    concept['aliases'] = CONCEPT_ALIASES[concept['name']]
+    
+    log(logging.INFO, "ai_concept", "Successfully generated: %s", concept['name'])
+    return concept
+
+# ─────────────────────────────────────────────
+#  PRE-GENERATED CONCEPT POOL
+# ─────────────────────────────────────────────
+
+class ConceptPool:
+    """
+    Per-difficulty buffer of ready AI concepts so /api/start in AI mode
+    doesn't wait on Gemini. A background producer refills a pool once it
+    drops to the low watermark, up to the high watermark.
+    """
+
+    def __init__(self, difficulties, low_watermark: int = 2, high_watermark: int = 5):
+        self.low_watermark = low_watermark
+        self.high_watermark = max(high_watermark, low_watermark + 1)
+        self._pools = {d: deque() for d in difficulties}
+        self._refilling = set(difficulties)
+        self._cond = threading.Condition()
+        self._thread = None
+        self._recently_produced = deque(maxlen=40)
+        self.served = {d: 0 for d in difficulties}
+        self.starved = {d: 0 for d in difficulties}
+        self.produced = {d: 0 for d in difficulties}
+        self.failures = 0
+
+    def ensure_started(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name="concept-pool")
+                self._thread.start()
+
+    def take(self, difficulty: str, exclude) -> dict:
+        """Pop a concept the session hasn't seen recently, or None if the pool is starved."""
+        self.ensure_started()
+        with self._cond:
+            pool = self._pools[difficulty]
+            for i, concept in enumerate(pool):
+                if concept['name'] not in exclude:
+                    del pool[i]
+                    self.served[difficulty] += 1
+                    if len(pool) <= self.low_watermark:
+                        self._refilling.add(difficulty)
+                        self._cond.notify()
+                    return concept
+            self.starved[difficulty] += 1
+            self._refilling.add(difficulty)
+            self._cond.notify()
+            return None
+
+    def _next_difficulty(self):
+        if not self._refilling:
+            return None
+        return min(self._refilling, key=lambda d: len(self._pools[d]))
+
+    def _run(self):
+        backoff = 5
+        while True:
+            with self._cond:
+                while self._next_difficulty() is None:
+                    self._cond.wait()
+                difficulty = self._next_difficulty()
+                # Pool members last: they must survive request_concept_from_ai's truncation
+                pooled = [c['name'] for c in self._pools[difficulty]]
+                exclusions = [n for n in self._recently_produced if n not in pooled] + pooled
             
-            # Track this concept
-            generate_concept_with_ai.used_concepts.add(concept['name'])
-            recent_concepts[session_id].append(concept['name'])
-            if len(recent_concepts[session_id]) > 20:
-                recent_concepts[session_id].pop(0)
+            try:
+                concept = request_concept_from_ai(difficulty, exclusions, priority="background")
+                backoff = 5
+            except Exception as e:
+                with self._cond:
+                    self.failures += 1
+                log(logging.WARNING, "concept_pool", "Refill failed for %s: %s", difficulty, e)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 120)
+                continue
             
-            print(f"[AI CONCEPT] Successfully generated: {concept['name']}")
+            with self._cond:
+                pool = self._pools[difficulty]
+                if concept['name'] not in (c['name'] for c in pool):
+                    pool.append(concept)
+                    self.produced[difficulty] += 1
+                    self._recently_produced.append(concept['name'])
+                if len(pool) >= self.high_watermark:
+                    self._refilling.discard(difficulty)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "running": self._thread is not None,
+                "low_watermark": self.low_watermark,
+                "high_watermark": self.high_watermark,
+                "depth": {d: len(p) for d, p in self._pools.items()},
+                "served": dict(self.served),
+                "starved": dict(self.starved),
+                "produced": dict(self.produced),
+                "failures": self.failures
+            }
+
+CONCEPT_POOL_ENABLED = os.environ.get('CIPHER_CONCEPT_POOL', '1') != '0'
+CONCEPT_POOL = ConceptPool(
+    ITEMS.keys(),
+    low_watermark=int(os.environ.get('CIPHER_CONCEPT_POOL_LOW', 2)),
+    high_watermark=int(os.environ.get('CIPHER_CONCEPT_POOL_HIGH', 5))
+)
+
+def take_ai_concept(difficulty: str, session_id: str) -> dict:
+    """Serve an AI concept from the pool, generating inline only when it is starved."""
+    if CONCEPT_POOL_ENABLED and not GEMINI_BREAKER.is_open():
+        pool_difficulty = difficulty if difficulty in ITEMS else 'hard'
+        concept = CONCEPT_POOL.take(pool_difficulty, set(recent_concepts.get(session_id, [])))
+        if concept is not None:
+            track_concept(session_id, concept['name'])
             return concept
-        else:
-            raise Exception("No response from AI")
-            
-    except Exception as e:
-        print(f"[AI CONCEPT ERROR] Failed to generate concept: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        
-        # Fallback to static pool with better selection
-        items = ITEMS.get(difficulty, ITEMS['hard'])
-        available = [item for item in items if item['name'] not in recent]
-        if not available:
-            available = items
-        selected = random.choice(available)
-        print(f"[AI CONCEPT] Using fallback: {selected['name']}")
-        return selected
+    return generate_concept_with_ai(difficulty, session_id)
 
 @app.route('/api/question', methods=['POST'])
 def ask_question():
@@ -512,64 +2334,90 @@ def ask_question():
     Handle user-submitted questions using AI evaluation.
     Uses Gemini 2.5 Flash to intelligently answer questions.
     """
+    with span("session_lookup"):
+        session, question_text, error = _check_question_request()
+    if error:
+        return jsonify({"error": error}), 400
+    
+    # Answer from cache or fact table when possible, AI otherwise
+    try:
+        with span("resolve_answer"):
+            answer = resolve_answer(question_text, session['item'])
+    except DegradedModeError as e:
+        return jsonify({"error": str(e), "degraded": True}), 503
+    with span("record_answer"):
+        result = _record_answer(session, question_text, answer)
+    with span("json_encode"):
+        return jsonify(result)
+
+@app.route('/api/question/stream', methods=['POST'])
+def ask_question_stream():
+    """
+    Server-Sent Events variant of /api/question: a "received" event right
+    away, then a "verdict" event as soon as the answer can be parsed.
+    """
+    session, question_text, error = _check_question_request()
+    if error:
+        return jsonify({"error": error}), 400
+    
+    def events():
+        yield sse_event("received", {"status": "evaluating", "question": question_text})
+        try:
+            answer = resolve_answer(question_text, session['item'], llm=stream_question_with_ai)
+        except DegradedModeError as e:
+            yield sse_event("verdict", {"error": str(e), "degraded": True})
+            return
+        yield sse_event("verdict", _record_answer(session, question_text, answer))
+    
+    return sse_response(events())
+
+def _check_question_request():
+    """Validate a question submission. Returns (session, question_text, error_message)."""
     data = request.json
     sid = get_session_id(request)
     session = sessions.get(sid)
     
     if not session:
-        return jsonify({"error": "No active game. Start a new game first."}), 400
+        return None, None, "No active game. Start a new game first."
     
     if session['game_over']:
-        return jsonify({"error": "Game over."}), 400
+        return None, None, "Game over."
     
     if session['questions_asked'] >= 20:
-        return jsonify({"error": "No questions remaining."}), 400
+        return None, None, "No questions remaining."
     
     # Get user's question text
     question_text = data.get('question_text', '').strip()
     
     if not question_text:
-        return jsonify({"error": "Question cannot be empty."}), 400
+        return None, None, "Question cannot be empty."
     
     if len(question_text) < 5:
-        return jsonify({"error": "Question must be at least 5 characters."}), 400
-    
-    # Check if question was already asked (case-insensitive)
-    question_lower = question_text.lower()
-    asked_questions = [q['question'].lower() for q in session['questions_log']]
-    if question_lower in asked_questions:
-        return jsonify({"error": "You already asked this question."}), 400
+        return None, None, "Question must be at least 5 characters."
     
-    # Use AI to evaluate the question
-    item = session['item']
-    answer = evaluate_question_with_ai(question_text, item)
+    # Check if question was already asked (paraphrases count as the same question)
+    if canonicalize_question(question_text) in session['asked_canonical']:
+        return None, None, "You already asked this question."
     
+    return session, question_text, None
+
+def _record_answer(session: dict, question_text: str, answer: str) -> dict:
     session['questions_asked'] += 1
+    session['asked_canonical'].add(canonicalize_question(question_text))
     session['questions_log'].append({
         "question": question_text,
         "answer": answer
     })
     
-    return jsonify({
+    return {
         "answer": answer,
         "questions_asked": session['questions_asked'],
         "questions_remaining": 20 - session['questions_asked'],
         "log": session['questions_log']
-    })
+    }
 
-def evaluate_question_with_ai(question: str, item: dict) -> str:
-    """
-    Use Gemini 2.5 Flash to evaluate a user's question with common sense.
-    
-    Args:
-        question: The user's natural language question
-        item: The concept dictionary with name, description, and facts
-        
-    Returns:
-        "Yes", "No", or "Irrelevant"
-    """
-    
-    prompt = f"""You are answering a yes/no question about a cybersecurity concept in a guessing game.
+def build_question_prompt(question: str, item: dict) -> str:
+    return f"""You are answering a yes/no question about a cybersecurity concept in a guessing game.
 
 THE CONCEPT: {item['name']}
 DESCRIPTION: {item['description']}
@@ -602,90 +2450,370 @@ Think step by step:
 
 Your answer (one word only):"""
 
+def evaluate_question_with_ai(question: str, item: dict) -> str:
+    """
+    Use Gemini 2.5 Flash to evaluate a user's question with common sense.
+    
+    Args:
+        question: The user's natural language question
+        item: The concept dictionary with name, description, and facts
+        
+    Returns:
+        "Yes", "No", or "Irrelevant"
+    """
+    cache_key = (item['name'], canonicalize_question(question))
+    
+    with span("prompt_build"):
+        prompt = build_question_prompt(question, item)
+
     try:
-        response = gemini_model.generate_content(
+        response = call_gemini(
+            "question",
             prompt,
             generation_config={
                 "temperature": 0.3,  # Slightly higher for better reasoning
                 "max_output_tokens": 20,
                 "top_p": 0.95,
-            }
+            },
+            hedge=True
         )
         
-        print(f"[AI DEBUG] Concept: {item['name']}")
-        print(f"[AI DEBUG] Question: {question}")
-        
         if response and hasattr(response, 'text') and response.text:
             answer = response.text.strip().strip('"').strip("'").strip('.')
-            print(f"[AI DEBUG] Raw answer: '{answer}'")
             
             # More flexible parsing
             answer_lower = answer.lower()
             
             # Check for yes
             if answer_lower in ['yes', 'y'] or answer_lower.startswith('yes'):
-                print(f"[AI DEBUG] Returning: Yes")
-                return "Yes"
+                result = "Yes"
             # Check for no
             elif answer_lower in ['no', 'n'] or answer_lower.startswith('no'):
-                print(f"[AI DEBUG] Returning: No")
-                return "No"
+                result = "No"
             # Check for irrelevant
             elif 'irrelevant' in answer_lower or 'not applicable' in answer_lower:
-                print(f"[AI DEBUG] Returning: Irrelevant")
-                return "Irrelevant"
+                result = "Irrelevant"
             else:
                 # If unclear, try to extract yes/no from the text
                 if 'yes' in answer_lower and 'no' not in answer_lower:
-                    print(f"[AI DEBUG] Found 'yes' in text, returning: Yes")
-                    return "Yes"
+                    result = "Yes"
                 elif 'no' in answer_lower and 'yes' not in answer_lower:
-                    print(f"[AI DEBUG] Found 'no' in text, returning: No")
-                    return "No"
+                    result = "No"
                 else:
-                    print(f"[AI DEBUG] Unclear response, returning: Irrelevant")
+                    # Don't cache unclear responses - a retry may do better
+                    log(logging.DEBUG, "ai_debug", "Unclear response, returning: Irrelevant",
+                        concept=item['name'], question=question, raw=answer)
                     return "Irrelevant"
+            
+            log(logging.DEBUG, "ai_debug", "Answered %s", result, concept=item['name'], question=question, raw=answer)
+            ANSWER_CACHE.put(cache_key, result)
+            return result
         else:
-            print(f"[AI ERROR] No text in response")
-            if response and hasattr(response, 'prompt_feedback'):
-                print(f"[AI DEBUG] Prompt feedback: {response.prompt_feedback}")
+            log(logging.WARNING, "ai_error", "No text in response",
+                feedback=getattr(response, 'prompt_feedback', None))
             return "Irrelevant"
             
+    except CircuitOpenError:
+        raise
     except Exception as e:
-        print(f"[AI ERROR] Exception: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log(logging.ERROR, "ai_error", "Exception: %s", e, exc_info=True)
+        # Let the caller fall back to the local engine instead of burning a question
+        raise
+
+# ─────────────────────────────────────────────
+#  QUESTION MICRO-BATCHING (opt-in)
+# ─────────────────────────────────────────────
+
+def _parse_batch_answer(value):
+    answer = str(value).strip().strip('"').strip("'").strip('.').lower()
+    if answer.startswith('yes'):
+        return "Yes"
+    if answer.startswith('no'):
+        return "No"
+    if 'irrelevant' in answer:
         return "Irrelevant"
+    return None
+
+def evaluate_questions_batch_with_ai(pairs: list) -> list:
+    """
+    Answer several (question, item) pairs with a single Gemini call.
+    Returns one answer per pair, or None where the model's output was unusable.
+    """
+    entries = [
+        {"id": i, "concept": item['name'], "description": item['description'], "question": question}
+        for i, (question, item) in enumerate(pairs)
+    ]
+    prompt = f"""You are answering yes/no questions about cybersecurity concepts in a guessing game.
+Each entry has its own concept; answer every question about ITS OWN concept only.
+
+RULES:
+1. If the concept name contains the answer, USE THAT (e.g. "DDoS Attack" → "is it an attack?" = Yes)
+2. Use your cybersecurity expertise and common sense
+3. "Irrelevant" ONLY if the question makes no sense or cannot be answered yes/no
+
+ENTRIES:
+{json.dumps(entries, indent=1)}
+
+OUTPUT FORMAT (JSON array, one object per entry, same ids):
+[{{"id": 0, "answer": "Yes"}}, {{"id": 1, "answer": "No"}}]
+
+Return ONLY valid JSON, no markdown, no explanations."""
+
+    response = call_gemini(
+        "question_batch",
+        prompt,
+        generation_config={
+            "temperature": 0.3,
+            "max_output_tokens": 20 * len(pairs) + 50,
+        }
+    )
+    text = response.text.strip()
+    if '```json' in text:
+        text = text.split('```json')[1].split('```')[0].strip()
+    elif '```' in text:
+        text = text.split('```')[1].split('```')[0].strip()
+    
+    answers = [None] * len(pairs)
+    for entry in json.loads(text):
+        idx = entry.get('id') if isinstance(entry, dict) else None
+        if isinstance(idx, int) and 0 <= idx < len(pairs):
+            answers[idx] = _parse_batch_answer(entry.get('answer', ''))
+    return answers
+
+class LatencyStats:
+    """Count / mean / max latency per label."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def record(self, label: str, seconds: float):
+        with self._lock:
+            entry = self._data.setdefault(label, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                label: {
+                    "count": count,
+                    "avg_ms": round(total / count * 1000, 1),
+                    "max_ms": round(peak * 1000, 1)
+                }
+                for label, (count, total, peak) in self._data.items()
+            }
+
+class QuestionBatcher:
+    """
+    Collects question evaluations from concurrent requests for a short window
+    (or until max_batch items) and answers them with one structured prompt.
+    While no batch is in flight there is nothing to wait for, so a question
+    arriving then is sent straight away on its own.
+    """
+
+    def __init__(self, window_ms: float = 30, max_batch: int = 16):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._in_flight = 0
+        self.batches = 0
+        self.items = 0
+        self.singles = 0
+        self.fallbacks = 0
+
+    def submit(self, question: str, item: dict) -> str:
+        """Block until the batch containing this question is answered, or the request's budget runs out."""
+        self._ensure_started()
+        call = FlightCall()
+        deadline = current_deadline()
+        self._queue.put((question, item, call, deadline))
+        with waiting_on("batch"):
+            answered = call.event.wait(timeout=None if deadline is None else max(0.0, deadline - time.time()))
+        if not answered:
+            _count_path("deadline_exceeded", RETRY_COUNTS)
+            raise DeadlineExceededError("Latency budget spent waiting for a batched answer")
+        if call.error is not None:
+            raise call.error
+        if call.result is None:
+            # Unusable batch output for this entry - ask on its own
+            with self._stats_lock:
+                self.fallbacks += 1
+            return evaluate_question_with_ai(question, item)
+        return call.result
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name="question-batcher")
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            with self._stats_lock:
+                idle = self._in_flight == 0
+            deadline = time.time() + (0 if idle else self.window)
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            # Also take whatever queued up meanwhile (a no-op wait when idle)
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            with self._stats_lock:
+                self._in_flight += 1
+            # Dispatch off the collector thread so the next window opens immediately
+            threading.Thread(target=self._dispatch, args=(batch,), daemon=True).start()
+
+    def _dispatch(self, batch: list):
+        # Gemini calls made here serve these requests, so they run under the earliest of their deadlines
+        deadlines = [deadline for _, _, _, deadline in batch if deadline is not None]
+        set_request_deadline(min(deadlines) if deadlines else None)
+        try:
+            if len(batch) == 1:
+                self._dispatch_single(*batch[0])
+            else:
+                self._dispatch_batch(batch)
+        finally:
+            with self._stats_lock:
+                self._in_flight -= 1
+
+    def _dispatch_single(self, question: str, item: dict, call, deadline):
+        """A lone question goes out as a normal question call - no batch prompt, no second round trip."""
+        with self._stats_lock:
+            self.singles += 1
+        try:
+            call.result = evaluate_question_with_ai(question, item)
+        except Exception as e:
+            call.error = e
+        call.event.set()
+
+    def _dispatch_batch(self, batch: list):
+        answers = [None] * len(batch)
+        with self._stats_lock:
+            self.batches += 1
+            self.items += len(batch)
+        try:
+            answers = evaluate_questions_batch_with_ai([(q, item) for q, item, _, _ in batch])
+        except ValueError as e:
+            # Gemini answered but the output wasn't JSON - each entry is re-asked on its own
+            log(logging.WARNING, "batch_error", "Batch of %d unparseable: %s", len(batch), e)
+        except Exception as e:
+            # Quota, open circuit or deadline: re-asking per entry would only multiply the failure
+            log(logging.WARNING, "batch_error", "Batch of %d failed: %s", len(batch), e)
+            for _, _, call, _ in batch:
+                call.error = e
+                call.event.set()
+            return
+        for (question, item, call, _), answer in zip(batch, answers):
+            if answer is not None:
+                ANSWER_CACHE.put((item['name'], canonicalize_question(question)), answer)
+            call.result = answer
+            call.event.set()
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "window_ms": self.window * 1000,
+                "max_batch": self.max_batch,
+                "batches": self.batches,
+                "batched_items": self.items,
+                "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+                "llm_calls_saved": self.items - self.batches,
+                "singles": self.singles,
+                "fallbacks": self.fallbacks
+            }
+
+QUESTION_BATCHER = QuestionBatcher(
+    window_ms=float(os.environ.get('CIPHER_BATCH_WINDOW_MS', 30)),
+    max_batch=int(os.environ.get('CIPHER_BATCH_MAX', 16))
+) if os.environ.get('CIPHER_QUESTION_BATCHING') == '1' else None
+
+QUESTION_LLM_LATENCY = LatencyStats()
+
+def evaluate_question(question: str, item: dict) -> str:
+    """Ask the LLM, batched with concurrent questions when batching is enabled."""
+    start = time.time()
+    if QUESTION_BATCHER is not None:
+        answer = QUESTION_BATCHER.submit(question, item)
+        QUESTION_LLM_LATENCY.record("batched", time.time() - start)
+    else:
+        answer = evaluate_question_with_ai(question, item)
+        QUESTION_LLM_LATENCY.record("unbatched", time.time() - start)
+    return answer
 
 @app.route('/api/guess', methods=['POST'])
 def make_guess():
     """
-    Validate player's guess using AI instead of fuzzy matching.
+    Validate player's guess: clear-cut cases locally, the ambiguous ones with AI.
     """
+    with span("session_lookup"):
+        session, data, guess, error = _check_guess_request()
+    if error:
+        return jsonify({"error": error}), 400
+    
+    # Match locally when clear-cut, AI for the ambiguous cases
+    try:
+        with span("check_guess"):
+            is_correct = check_guess(guess, session['item'])
+    except DegradedModeError as e:
+        return jsonify({"error": str(e), "degraded": True}), 503
+    with span("apply_guess", correct=is_correct):
+        result = _apply_guess(session, data, is_correct)
+    with span("json_encode"):
+        return jsonify(result)
+
+@app.route('/api/guess/stream', methods=['POST'])
+def make_guess_stream():
+    """Server-Sent Events variant of /api/guess ("received", then "verdict")."""
+    session, data, guess, error = _check_guess_request()
+    if error:
+        return jsonify({"error": error}), 400
+    
+    def events():
+        yield sse_event("received", {"status": "evaluating", "guess": guess})
+        try:
+            is_correct = check_guess(guess, session['item'], llm=stream_guess_with_ai)
+        except DegradedModeError as e:
+            yield sse_event("verdict", {"error": str(e), "degraded": True})
+            return
+        yield sse_event("verdict", _apply_guess(session, data, is_correct))
+    
+    return sse_response(events())
+
+def _check_guess_request():
+    """Validate a guess submission. Returns (session, data, guess, error_message)."""
     data = request.json
     sid = get_session_id(request)
     session = sessions.get(sid)
     
     if not session:
-        return jsonify({"error": "No active game."}), 400
+        return None, None, None, "No active game."
     
     if session['game_over']:
-        return jsonify({"error": "Game over."}), 400
+        return None, None, None, "Game over."
     
     guess = data.get('guess', '').strip()
     
     if not guess or len(guess) < 3:
-        return jsonify({"error": "Guess must be at least 3 characters."}), 400
-    
-    # Use AI to validate the guess
-    item = session['item']
-    try:
-        is_correct = validate_guess_with_ai(guess, item)
-    except Exception as e:
-        print(f"[GUESS ERROR] AI validation failed: {str(e)}")
-        # Fallback to exact match if AI fails
-        is_correct = guess.lower() == item['name'].lower()
+        return None, None, None, "Guess must be at least 3 characters."
     
+    return session, data, guess, None
+
+def _apply_guess(session: dict, data: dict, is_correct: bool) -> dict:
+    """Update hearts, score and leaderboard for a judged guess and build the response."""
     if is_correct:
         hints_used = session['hints_used']
         xp = 100 if hints_used == 0 else (70 if hints_used == 1 else 40)
@@ -704,46 +2832,36 @@ def make_guess():
         for i, entry in enumerate(LEADERBOARD[:10]):
             entry['rank'] = i + 1
         
-        return jsonify({
+        return {
             "correct": True,
             "xp_earned": xp,
             "item": session['item'],
             "questions_used": session['questions_asked'],
             "hearts_remaining": session['hearts']
-        })
+        }
     else:
         session['hearts'] -= 1
         session['wrong_guesses'] += 1
         
         if session['hearts'] <= 0:
             session['game_over'] = True
-            return jsonify({
+            return {
                 "correct": False,
                 "game_over": True,
                 "hearts_remaining": 0,
                 "item": session['item'],
                 "message": "Game Over! You've lost all your lives."
-            })
+            }
         
-        return jsonify({
+        return {
             "correct": False,
             "game_over": False,
             "hearts_remaining": session['hearts'],
             "message": f"Wrong guess! {session['hearts']} {'heart' if session['hearts'] == 1 else 'hearts'} remaining."
-        })
+        }
 
-def validate_guess_with_ai(guess: str, item: dict) -> bool:
-    """
-    Use Gemini 2.5 Flash to validate if a guess matches the concept.
-    
-    Args:
-        guess: The player's guess
-        item: The concept dictionary with name, description, and category
-        
-    Returns:
-        True if correct, False otherwise
-    """
-    prompt = f"""You are validating a player's guess in a cybersecurity guessing game.
+def build_guess_prompt(guess: str, item: dict) -> str:
+    return f"""You are validating a player's guess in a cybersecurity guessing game.
 
 The CORRECT ANSWER is: {item['name']}
 Category: {item['category']}
@@ -767,35 +2885,105 @@ Respond with ONLY one word:
 
 Answer:"""
 
+def validate_guess_with_ai(guess: str, item: dict) -> bool:
+    """
+    Use Gemini 2.5 Flash to validate if a guess matches the concept.
+    
+    Args:
+        guess: The player's guess
+        item: The concept dictionary with name, description, and category
+        
+    Returns:
+        True if correct, False otherwise
+    """
+    prompt = build_guess_prompt(guess, item)
+
     try:
-        response = gemini_model.generate_content(
+        response = call_gemini(
+            "guess",
             prompt,
             generation_config={
                 "temperature": 0.1,
                 "max_output_tokens": 10,
-            }
+            },
+            hedge=True
         )
         
-        print(f"[GUESS DEBUG] Guess: {guess}, Answer: {item['name']}")
-        print(f"[GUESS DEBUG] Raw response: {response}")
-        
         if response and hasattr(response, 'text') and response.text:
             result = response.text.strip().upper()
-            print(f"[GUESS DEBUG] Parsed result: {result}")
+            log(logging.DEBUG, "guess_debug", "Parsed result: %s", result, guess=guess, concept=item['name'])
             return "CORRECT" in result
         else:
-            print(f"[GUESS ERROR] No text in response")
-            if response and hasattr(response, 'prompt_feedback'):
-                print(f"[GUESS DEBUG] Prompt feedback: {response.prompt_feedback}")
+            log(logging.WARNING, "guess_error", "No text in response",
+                feedback=getattr(response, 'prompt_feedback', None))
             # Fallback to exact match
             return guess.lower() == item['name'].lower()
             
+    except CircuitOpenError:
+        raise
     except Exception as e:
-        print(f"[GUESS ERROR] Exception: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        # Fallback to exact match
-        return guess.lower() == item['name'].lower()
+        log(logging.ERROR, "guess_error", "Exception: %s", e, exc_info=True)
+        # Let check_guess fall back to local matching
+        raise
+
+# ─────────────────────────────────────────────
+#  STREAMING (Server-Sent Events)
+# ─────────────────────────────────────────────
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def sse_response(events):
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def _stream_first_word(call_site: str, prompt: str, generation_config: dict) -> str:
+    """
+    Stream a completion and stop reading as soon as its first word is complete.
+    Returns the text received so far (the whole text if it never got past one word).
+    """
+    text = ""
+    response = call_gemini(call_site, prompt, generation_config, stream=True)
+    try:
+        for chunk in response:
+            try:
+                text += chunk.text
+            except ValueError:
+                # Chunk without text parts (e.g. safety / finish metadata)
+                continue
+            word = text.strip().strip('"').strip("'")
+            if word and re.search(r"[^A-Za-z]", word):
+                break
+    finally:
+        # Frees the call's concurrency slot now rather than when the stream is garbage collected
+        response.close()
+    return text
+
+def stream_question_with_ai(question: str, item: dict) -> str:
+    """Streaming counterpart of evaluate_question_with_ai: returns once the verdict word arrives."""
+    text = _stream_first_word("question", build_question_prompt(question, item), {
+        "temperature": 0.3,
+        "max_output_tokens": 20,
+        "top_p": 0.95,
+    })
+    
+    answer = _parse_batch_answer(text.split()[0] if text.split() else "")
+    if answer is None:
+        return "Irrelevant"
+    ANSWER_CACHE.put((item['name'], canonicalize_question(question)), answer)
+    return answer
+
+def stream_guess_with_ai(guess: str, item: dict) -> bool:
+    """Streaming counterpart of validate_guess_with_ai."""
+    text = _stream_first_word("guess", build_guess_prompt(guess, item), {
+        "temperature": 0.1,
+        "max_output_tokens": 10,
+    })
+    first = re.sub(r"[^A-Z]", "", text.strip().split()[0].upper()) if text.split() else ""
+    return first == "CORRECT"
 
 @app.route('/api/hint', methods=['POST'])
 def get_hint():
@@ -825,6 +3013,118 @@ def get_hint():
 def leaderboard():
     return jsonify({"leaderboard": LEADERBOARD[:10]})
 
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    return jsonify({
+        "answer_cache": ANSWER_CACHE.stats(),
+        "question_paths": dict(QUESTION_PATH_COUNTS),
+        "guess_paths": dict(GUESS_PATH_COUNTS),
+        "concept_pool": CONCEPT_POOL.stats(),
+        "single_flight": LLM_FLIGHTS.stats(),
+        "question_batching": QUESTION_BATCHER.stats() if QUESTION_BATCHER else {"enabled": False},
+        "question_llm_latency": QUESTION_LLM_LATENCY.stats(),
+        "gemini_circuit": GEMINI_BREAKER.stats(),
+        "gemini_quota": GEMINI_QUOTA.stats(),
+        "gemini_concurrency": GEMINI_CONCURRENCY.stats(),
+        "gemini_hedging": GEMINI_HEDGER.stats() if GEMINI_HEDGER else {"enabled": False},
+        "gemini_retries": dict(RETRY_COUNTS),
+        "gemini_cassette": GEMINI_CASSETTE.stats() if GEMINI_CASSETTE else {"enabled": False},
+        "logging": {"level": LOG_LEVEL, "queued": _log_handler.queue.qsize(), "dropped": DroppingQueueHandler.dropped},
+        "tracing": TRACE_EXPORTER.stats() if TRACE_EXPORTER else {"enabled": False},
+        "profiling": REQUEST_PROFILER.stats() if REQUEST_PROFILER else {"enabled": False},
+        "sampling_profiler": SAMPLING_PROFILER.stats() if SAMPLING_PROFILER else {"enabled": False}
+    })
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus text exposition: histograms/counters from METRICS plus values read at scrape time."""
+    cache = ANSWER_CACHE.stats()
+    active = sum(1 for s in list(sessions.values()) if not s.get('game_over'))
+    snapshots = [
+        ("cipher_sessions", "gauge", "Game sessions held in memory by state.",
+         [((("state", "active"),), active), ((("state", "finished"),), len(sessions) - active)]),
+        ("cipher_leaderboard_entries", "gauge", "Entries on the in-memory leaderboard.", [((), len(LEADERBOARD))]),
+        ("cipher_answer_cache_hit_ratio", "gauge", "Answer cache hits / lookups since start.", [((), cache['hit_ratio'])]),
+        ("cipher_answer_cache_entries", "gauge", "Entries in the answer cache.", [((), cache['size'])]),
+        ("cipher_answer_cache_lookups_total", "counter", "Answer cache lookups by result.",
+         [((("result", "hit"),), cache['hits']), ((("result", "miss"),), cache['misses'])]),
+        ("cipher_question_answers_total", "counter", "Answered questions by resolution path.",
+         [((("path", k),), v) for k, v in QUESTION_PATH_COUNTS.items()]),
+        ("cipher_guess_resolutions_total", "counter", "Judged guesses by resolution path.",
+         [((("path", k),), v) for k, v in GUESS_PATH_COUNTS.items()]),
+        ("cipher_gemini_concurrency_limit", "gauge", "Current adaptive Gemini in-flight limit.",
+         [((), GEMINI_CONCURRENCY.stats()['limit'])]),
+        ("cipher_gemini_circuit_open", "gauge", "1 while the Gemini circuit breaker is open.",
+         [((), int(GEMINI_BREAKER.is_open()))]),
+    ]
+    return Response(METRICS.render(snapshots), mimetype='text/plain; version=0.0.4')
+
+def admin_denied():
+    """404 while admin features are off, 403 for a wrong token, None when authorized."""
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "Not found"}), 404
+    if not admin_authorized(request.headers.get('X-Admin-Token')):
+        return jsonify({"error": "Admin token required"}), 403
+    return None
+
+@app.route('/admin/profiles', methods=['GET'])
+def list_profiles():
+    denied = admin_denied()
+    if denied:
+        return denied
+    return jsonify({"profiles": REQUEST_PROFILER.captures() if REQUEST_PROFILER else []})
+
+@app.route('/admin/profiles/<name>', methods=['GET'])
+def get_profile(name):
+    """The raw .pstats file, or ?format=text for the top functions by cumulative time."""
+    denied = admin_denied()
+    if denied:
+        return denied
+    path = os.path.join(PROFILE_DIR, name)
+    if not PROFILE_NAME.match(name) or not os.path.isfile(path):
+        return jsonify({"error": "No such profile"}), 404
+    if request.args.get('format') == 'text':
+        out = io.StringIO()
+        stats = pstats.Stats(path, stream=out)
+        sort = request.args.get('sort', 'cumulative')
+        stats.sort_stats(sort if sort in ('cumulative', 'tottime', 'ncalls') else 'cumulative')
+        stats.print_stats(request.args.get('limit', 40, type=int))
+        return Response(out.getvalue(), mimetype='text/plain')
+    with open(path, 'rb') as f:
+        return Response(f.read(), mimetype='application/octet-stream',
+                        headers={"Content-Disposition": f'attachment; filename="{name}"'})
+
+@app.route('/admin/flamegraph', methods=['GET'])
+def flamegraph():
+    """
+    Sampling profiler output: an SVG flame graph, or ?format=collapsed for
+    flamegraph.pl / speedscope input. ?idle=0 drops threads parked in a wait
+    (Gemini calls, idle workers); ?reset=1 starts a new window after rendering.
+    """
+    denied = admin_denied()
+    if denied:
+        return denied
+    if SAMPLING_PROFILER is None:
+        return jsonify({"error": "Sampling profiler is off (set CIPHER_SAMPLER_HZ)"}), 404
+    stacks = SAMPLING_PROFILER.collapsed(include_idle=request.args.get('idle') != '0')
+    stats = SAMPLING_PROFILER.stats()
+    if request.args.get('reset') == '1':
+        SAMPLING_PROFILER.reset()
+    if request.args.get('format') == 'collapsed':
+        body = "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+        return Response(body, mimetype='text/plain')
+    title = f"cipher_game: {sum(stacks.values())} stack samples over {stats['window_s']}s at {stats['hz']:g} Hz"
+    return Response(render_flamegraph(stacks, title), mimetype='image/svg+xml')
+
+@app.route('/api/health', methods=['GET'])
+def health():
+    """Operator view: "degraded" while Gemini is bypassed and the local engine is serving."""
+    circuit = GEMINI_BREAKER.stats()
+    return jsonify({
+        "status": "ok" if circuit['state'] == "closed" else "degraded",
+        "gemini_circuit": circuit
+    })
+
 @app.route('/api/session', methods=['GET'])
 def get_session():
     sid = get_session_id(request)
@@ -839,6 +3139,12 @@ def get_session():
         "log": session['questions_log']
     })
 
+# Only installed when something can flag a request, so the default path has no wrapper at all
+REQUEST_PROFILER = None
+if ADMIN_TOKEN or PROFILE_SAMPLE > 0:
+    REQUEST_PROFILER = RequestProfiler(app.wsgi_app, app.url_map, PROFILE_DIR, PROFILE_SAMPLE, PROFILE_KEEP)
+    app.wsgi_app = REQUEST_PROFILER
+
 
 HTML_TEMPLATE = '''<!DOCTYPE html>
 <html lang="en">
@@ -2075,6 +4381,59 @@ async function startGame() {
   document.getElementById('screen-game').style.display = 'block';
 }
 
+// ─────────────────────────────────────────────
+// STREAMING (Server-Sent Events over POST)
+// ─────────────────────────────────────────────
+async function postEventStream(url, body, onEvent) {
+  const resp = await fetch(url, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' },
+    body: JSON.stringify(body)
+  });
+  
+  // Validation errors come back as plain JSON
+  if (!(resp.headers.get('Content-Type') || '').includes('text/event-stream')) {
+    onEvent('verdict', await resp.json());
+    return;
+  }
+  
+  const reader = resp.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let sep;
+    while ((sep = buffer.indexOf('\\n\\n')) !== -1) {
+      const raw = buffer.slice(0, sep);
+      buffer = buffer.slice(sep + 2);
+      let event = 'message', data = '';
+      raw.split('\\n').forEach(line => {
+        if (line.startsWith('event: ')) event = line.slice(7);
+        else if (line.startsWith('data: ')) data += line.slice(6);
+      });
+      if (data) onEvent(event, JSON.parse(data));
+    }
+  }
+}
+
+function addPendingLog(question) {
+  const log = document.getElementById('answer-log');
+  const placeholder = log.querySelector('.terminal-text');
+  if (placeholder) placeholder.remove();
+  
+  const item = document.createElement('div');
+  item.className = 'log-item irr';
+  item.innerHTML = `
+    <span class="log-q">${question}</span>
+    <span class="log-a irr">EVALUATING…</span>
+  `;
+  log.appendChild(item);
+  log.scrollTop = log.scrollHeight;
+  return item;
+}
+
 // ─────────────────────────────────────────────
 // SUBMIT QUESTION (User types their own)
 // ─────────────────────────────────────────────
@@ -2108,17 +4467,19 @@ async function submitQuestion() {
   // Disable input temporarily
   input.disabled = true;
   
+  let pending = null;
+  let data = null;
+  
   try {
-    const resp = await fetch('/api/question', {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ question_text: questionText })
+    await postEventStream('/api/question/stream', { question_text: questionText }, (event, payload) => {
+      if (event === 'received') pending = addPendingLog(questionText);
+      else if (event === 'verdict') data = payload;
     });
     
-    const data = await resp.json();
+    if (pending) pending.remove();
     
-    if (data.error) {
-      showFeedback(data.error, 'irr');
+    if (!data || data.error) {
+      showFeedback(data ? data.error : 'Error asking question', 'irr');
       input.disabled = false;
       return;
     }
@@ -2147,6 +4508,7 @@ async function submitQuestion() {
       showFeedback('No more questions! Make your final guess.', 'irr');
     }
   } catch (error) {
+    if (pending) pending.remove();
     showFeedback('Error asking question', 'irr');
     input.disabled = false;
   }
@@ -2225,16 +4587,24 @@ async function submitGuess() {
   const guess = document.getElementById('guess-input').value.trim();
   if (!guess) return;
   
-  const resp = await fetch('/api/guess', {
-    method: 'POST',
-    headers: { 'Content-Type': 'application/json' },
-    body: JSON.stringify({ 
-      guess: guess, 
-      player_name: state.playerName 
-    })
+  const guessInput = document.getElementById('guess-input');
+  let data = null;
+  
+  await postEventStream('/api/guess/stream', { guess: guess, player_name: state.playerName }, (event, payload) => {
+    if (event === 'received') {
+      guessInput.disabled = true;
+      guessInput.style.borderColor = 'var(--warning)';
+    } else if (event === 'verdict') {
+      data = payload;
+    }
   });
   
-  const data = await resp.json();
+  guessInput.disabled = false;
+  guessInput.style.borderColor = '';
+  if (!data || data.error) {
+    showFeedback(data ? data.error : 'Error submitting guess', 'irr');
+    return;
+  }
   
   if (data.correct) {
     showResult(true, data);
@@ -2377,4 +4747,5 @@ updateHUD();
 if __name__ == '__main__':
     import os
     port = int(os.environ.get('PORT', 5000))
+    start_alias_loader()
     app.run(host='0.0.0.0', port=port, debug=False)
@@ -0,0 +1,491 @@
+"""
+CODE SHARED BY BOTH FRONT ENDS
+
+Pieces used by both front ends - the Flask app (cipher_game.py) and the
+Streamlit app (OneDrive/Desktop/cipher/cipher_app.py) - so a fix lands once.
+Everything here is framework-free and each app builds its own instances; the
+quota scheduler's defaults live here too, since both apps must agree on them.
+"""
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# ─────────────────────────────────────────────
+#  SINGLE-FLIGHT
+# ─────────────────────────────────────────────
+
+class FlightCall:
+    """Result slot filled by one thread while others wait on its event."""
+
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical calls: the first caller for a key runs the
+    function, everyone arriving while it is in flight waits and shares the result.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = FlightCall()
+                self._calls[key] = call
+                self.leaders += 1
+            else:
+                self.followers += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "calls": self.leaders,
+                "coalesced": self.followers
+            }
+
+# ─────────────────────────────────────────────
+#  QUOTA SCHEDULER
+# ─────────────────────────────────────────────
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to per-process buckets
+    fcntl = None
+
+class QuotaExceededError(Exception):
+    """The request could not be scheduled within its allowed wait."""
+
+# Weighted fair queuing shares: player-blocking calls vs. work that can wait
+PRIORITY_WEIGHTS = {"interactive": 8, "background": 1}
+
+class QuotaScheduler:
+    """
+    Token buckets for requests/min and tokens/min, shared by every thread and
+    every worker process on this host through a flock-protected state file.
+    Callers wait (up to max_wait) for capacity instead of running into 429s,
+    and are shed with QuotaExceededError beyond that.
+
+    Waiters are served by weighted fair queuing across priority classes, and
+    background calls may not dip into the share reserved for interactive ones.
+    """
+
+    def __init__(self, name: str, rpm: float, tpm: float, state_file: str, max_wait: float = 5,
+                 background_max_wait: float = 60, background_reserve: float = 0.2):
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+        self.state_file = state_file
+        self.max_wait = max_wait
+        self.background_max_wait = background_max_wait
+        self.background_reserve = background_reserve
+        self._lock = threading.Lock()
+        self._memory_state = {}
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._seq = 0
+        self._vtime = 0.0
+        self._last_tag = {p: 0.0 for p in PRIORITY_WEIGHTS}
+        self.granted = {p: 0 for p in PRIORITY_WEIGHTS}
+        self.shed = {p: 0 for p in PRIORITY_WEIGHTS}
+        self.waited_seconds = {p: 0.0 for p in PRIORITY_WEIGHTS}
+
+    def _update(self, fn):
+        """Run fn(bucket, now) against the shared bucket state under the lock and return its result."""
+        with self._lock:
+            if fcntl is None:
+                return self._apply(self._memory_state, fn)
+            with open(self.state_file, 'a+') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    raw = f.read()
+                    try:
+                        state = json.loads(raw) if raw else {}
+                    except ValueError:
+                        state = {}
+                    result = self._apply(state, fn)
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(state))
+                    f.flush()
+                    return result
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _apply(self, state: dict, fn):
+        now = time.time()
+        bucket = state.setdefault(self.name, {"requests": self.rpm, "tokens": self.tpm, "updated": now})
+        elapsed = max(0.0, now - bucket["updated"])
+        bucket["requests"] = min(self.rpm, bucket["requests"] + elapsed * self.rpm / 60)
+        bucket["tokens"] = min(self.tpm, bucket["tokens"] + elapsed * self.tpm / 60)
+        bucket["updated"] = now
+        return fn(bucket)
+
+    def acquire(self, tokens: int, priority: str = "interactive", max_wait: float = None):
+        """Block until one request and `tokens` tokens are available for this priority class."""
+        tokens = min(tokens, self.tpm)
+        if max_wait is None:
+            max_wait = self.background_max_wait if priority == "background" else self.max_wait
+        start = time.time()
+        deadline = start + max_wait
+
+        # Background calls must leave a reserve of each bucket for interactive traffic
+        reserve = self.background_reserve if priority == "background" else 0.0
+
+        def take(bucket):
+            need_requests = 1 + reserve * self.rpm
+            need_tokens = tokens + reserve * self.tpm
+            if bucket["requests"] >= need_requests and bucket["tokens"] >= need_tokens:
+                bucket["requests"] -= 1
+                bucket["tokens"] -= tokens
+                return 0.0
+            return max((need_requests - bucket["requests"]) * 60 / self.rpm,
+                       (need_tokens - bucket["tokens"]) * 60 / self.tpm)
+
+        ticket = self._enqueue(priority)
+        try:
+            while True:
+                self._wait_for_turn(ticket, priority, deadline)
+                wait = self._update(take)
+                if wait == 0.0:
+                    with self._cond:
+                        self.granted[priority] += 1
+                        self.waited_seconds[priority] += time.time() - start
+                        self._vtime = max(self._vtime, ticket[0])
+                    return
+                if time.time() + wait > deadline:
+                    raise self._shed(priority, wait)
+                with self._cond:
+                    # Step aside while waiting for refill so others (e.g. interactive calls
+                    # that may use the reserve) aren't blocked behind this one
+                    ticket[3] = time.time() + min(wait, 0.25)
+                    self._cond.notify_all()
+        finally:
+            with self._cond:
+                self._waiters.remove(ticket)
+                self._cond.notify_all()
+
+    def _wait_for_turn(self, ticket: list, priority: str, deadline: float):
+        """Wait until this ticket has the smallest fair-queuing tag among waiters ready to draw."""
+        with self._cond:
+            while True:
+                now = time.time()
+                ready = [t for t in self._waiters if t[3] <= now]
+                if ready and min(ready) is ticket:
+                    return
+                if now >= deadline:
+                    raise self._shed(priority, 0.0)
+                next_ready = min((t[3] for t in self._waiters if t[3] > now), default=now + 0.25)
+                self._cond.wait(timeout=max(0.001, min(deadline, next_ready) - now))
+
+    def _enqueue(self, priority: str) -> list:
+        with self._cond:
+            tag = max(self._vtime, self._last_tag[priority]) + 1.0 / PRIORITY_WEIGHTS[priority]
+            self._last_tag[priority] = tag
+            self._seq += 1
+            # [finish tag, arrival order, class, not ready before]
+            ticket = [tag, self._seq, priority, 0.0]
+            self._waiters.append(ticket)
+            return ticket
+
+    def _shed(self, priority: str, wait: float) -> QuotaExceededError:
+        with self._cond:   # re-entrant: _wait_for_turn already holds it
+            self.shed[priority] += 1
+        return QuotaExceededError(f"Gemini quota exhausted for {priority} traffic, retry in {wait:.1f}s")
+
+    def settle(self, estimated: int, actual: int):
+        """Correct the token bucket once the real usage of a call is known."""
+        if actual and actual != estimated:
+            def adjust(bucket):
+                bucket["tokens"] = min(self.tpm, bucket["tokens"] + estimated - actual)
+            self._update(adjust)
+
+    def stats(self) -> dict:
+        levels = self._update(lambda bucket: dict(bucket))
+        with self._cond:
+            return {
+                "backend": "flock" if fcntl else "memory",
+                "rpm": self.rpm,
+                "tpm": self.tpm,
+                "available_requests": round(levels["requests"], 2),
+                "available_tokens": int(levels["tokens"]),
+                "waiting": len(self._waiters),
+                "classes": {
+                    p: {
+                        "weight": PRIORITY_WEIGHTS[p],
+                        "granted": self.granted[p],
+                        "shed": self.shed[p],
+                        "avg_wait_ms": round(self.waited_seconds[p] / self.granted[p] * 1000, 1) if self.granted[p] else 0.0
+                    }
+                    for p in PRIORITY_WEIGHTS
+                }
+            }
+
+def quota_scheduler_from_env(name: str) -> QuotaScheduler:
+    """
+    The scheduler for one API key (`name`), from the CIPHER_GEMINI_*/CIPHER_QUOTA_*
+    settings. Both apps build theirs here, so one key on one host shares a
+    single state file and a single set of limits.
+    """
+    return QuotaScheduler(
+        name=name,
+        rpm=float(os.environ.get('CIPHER_GEMINI_RPM', 60)),
+        tpm=float(os.environ.get('CIPHER_GEMINI_TPM', 1000000)),
+        state_file=os.environ.get('CIPHER_QUOTA_FILE', os.path.join(tempfile.gettempdir(), 'cipher_gemini_quota.json')),
+        max_wait=float(os.environ.get('CIPHER_QUOTA_MAX_WAIT', 5)),
+        background_max_wait=float(os.environ.get('CIPHER_QUOTA_BACKGROUND_MAX_WAIT', 60)),
+        background_reserve=float(os.environ.get('CIPHER_QUOTA_BACKGROUND_RESERVE', 0.2))
+    )
+
+# ─────────────────────────────────────────────
+#  ADAPTIVE CONCURRENCY (AIMD)
+# ─────────────────────────────────────────────
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Caps in-flight Gemini requests with a limit that adapts itself:
+    +1 per limit's worth of fast successes (additive increase), x0.5 on
+    429/5xx/timeouts and x0.9 on slow responses (multiplicative decrease).
+    Decreases happen at most once per `decrease_interval` so one burst of
+    errors doesn't collapse the limit to the floor.
+    """
+
+    def __init__(self, initial: float = 8, min_limit: float = 1, max_limit: float = 64,
+                 latency_target: float = 8, decrease_interval: float = 1.0):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.decrease_interval = decrease_interval
+        self._cond = threading.Condition()
+        self._last_decrease = 0.0
+        self.in_flight = 0
+        self.queued = 0
+        self.increases = 0
+        self.decreases = 0
+
+    def acquire(self, timeout: float):
+        deadline = time.time() + timeout
+        with self._cond:
+            self.queued += 1
+            try:
+                while self.in_flight >= int(self.limit):
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise QuotaExceededError(f"No Gemini concurrency slot (limit {int(self.limit)})")
+                    self._cond.wait(timeout=remaining)
+                self.in_flight += 1
+            finally:
+                self.queued -= 1
+
+    def release(self, outcome: str, seconds: float):
+        """outcome: "ok", "overload" (429/5xx/timeout), or None for errors that say nothing about load."""
+        with self._cond:
+            self.in_flight -= 1
+            now = time.time()
+            if outcome == "overload" or (outcome == "ok" and seconds > self.latency_target):
+                if now - self._last_decrease >= self.decrease_interval:
+                    factor = 0.5 if outcome == "overload" else 0.9
+                    self.limit = max(self.min_limit, self.limit * factor)
+                    self._last_decrease = now
+                    self.decreases += 1
+            elif outcome == "ok":
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+                self.increases += 1
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "queued": self.queued,
+                "increases": self.increases,
+                "decreases": self.decreases
+            }
+
+# ─────────────────────────────────────────────
+#  HEDGED REQUESTS
+# ─────────────────────────────────────────────
+
+class Hedger:
+    """
+    Fires a duplicate of an idempotent call when the original hasn't
+    returned by the call site's rolling p95 latency.
+    Hedges are capped at `budget` x primary calls to bound extra quota use.
+
+    The primary runs on the caller's thread, so it keeps the request's
+    thread-local context and never queues behind other calls; only hedges
+    use the pool, and only while a worker is free. A primary that succeeds
+    wins; one that fails (a stall that ends in a timeout, a 5xx) is covered
+    by its hedge if one is running.
+    """
+
+    def __init__(self, budget: float = 0.1, min_samples: int = 20, min_delay: float = 0.5, workers: int = 32):
+        self.budget = budget
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hedge")
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._running = 0
+        self.primaries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def _delay(self, call_site: str):
+        with self._lock:
+            samples = sorted(self._latencies.get(call_site, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return max(self.min_delay, samples[int(len(samples) * 0.95) - 1])
+
+    def _record(self, call_site: str, seconds: float):
+        with self._lock:
+            self._latencies.setdefault(call_site, deque(maxlen=200)).append(seconds)
+
+    def _launch_hedge(self, fn, state: dict):
+        """Timer callback: start the hedge unless the primary finished, the budget is spent or the pool is busy."""
+        with self._lock:
+            if state["done"] or self._running >= self.workers or self.hedges + 1 > self.budget * self.primaries:
+                return
+            self.hedges += 1
+            self._running += 1
+            state["hedge"] = self._executor.submit(self._run_hedge, fn)
+
+    def _run_hedge(self, fn):
+        try:
+            return fn()
+        finally:
+            with self._lock:
+                self._running -= 1
+
+    def run(self, call_site: str, fn):
+        start = time.time()
+        with self._lock:
+            self.primaries += 1
+        state = {"done": False, "hedge": None}
+        delay = self._delay(call_site)
+        timer = None
+        if delay is not None:
+            timer = threading.Timer(delay, self._launch_hedge, args=(fn, state))
+            timer.daemon = True
+            timer.start()
+
+        try:
+            result = fn()
+        except Exception as e:
+            error = e
+        else:
+            self._record(call_site, time.time() - start)
+            return result
+        finally:
+            with self._lock:
+                state["done"] = True
+            if timer is not None:
+                timer.cancel()
+
+        if state["hedge"] is None:
+            raise error
+        try:
+            result = state["hedge"].result()
+        except Exception:
+            raise error
+        with self._lock:
+            self.hedge_wins += 1
+        self._record(call_site, time.time() - start)
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            p95 = {site: round(sorted(s)[int(len(s) * 0.95) - 1] * 1000, 1)
+                   for site, s in self._latencies.items() if s}
+            return {
+                "budget": self.budget,
+                "primaries": self.primaries,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "p95_ms": p95
+            }
+
+# ─────────────────────────────────────────────
+#  GUESS NORMALIZATION
+# ─────────────────────────────────────────────
+
+GUESS_ACRONYMS = {
+    "ddos": "distributed denial of service",
+    "dos": "denial of service",
+    "xss": "cross site scripting",
+    "csrf": "cross site request forgery",
+    "xsrf": "cross site request forgery",
+    "apt": "advanced persistent threat",
+    "mitm": "man in the middle",
+    "sqli": "sql injection",
+    "rce": "remote code execution",
+    "xxe": "xml external entity",
+    "ssrf": "server side request forgery",
+    "qkd": "quantum key distribution",
+    "fhe": "fully homomorphic encryption",
+    "aml": "adversarial machine learning",
+    "ml": "machine learning",
+    "ai": "artificial intelligence",
+    "ids": "intrusion detection system",
+    "ips": "intrusion prevention system",
+    "mfa": "multi factor authentication",
+    "2fa": "two factor authentication",
+    "vpn": "virtual private network",
+    "0day": "zero day"
+}
+
+# Words that don't distinguish one concept from another
+GUESS_GENERIC_WORDS = {
+    "a", "an", "the", "of", "and", "in", "attack", "attacks", "exploit", "framework",
+    "technique", "method", "concept", "type", "malware", "software"
+}
+
+def guess_tokens(text: str) -> list:
+    """Lowercase, expand acronyms and drop generic words."""
+    words = re.findall(r"[a-z0-9]+", text.lower().replace('&', ''))
+    tokens = []
+    for word in words:
+        tokens.extend(GUESS_ACRONYMS.get(word, word).split())
+    return [t for t in tokens if t not in GUESS_GENERIC_WORDS]
+
+def alias_key(text: str) -> str:
+    """Normalized lookup key shared by aliases and guesses."""
+    return ''.join(guess_tokens(text))
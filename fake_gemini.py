@@ -0,0 +1,424 @@
+"""
+OFFLINE GEMINI STAND-IN
+
+A fake Gemini for load and latency testing without API keys or quota.
+
+Two ways to use it:
+- In-process `genai` replacement for cipher_game.py:
+      CIPHER_FAKE_GEMINI=1 python cipher_game.py
+- Local HTTP server speaking the `:generateContent` REST shape for cipher_app.py:
+      python fake_gemini.py --port 8089
+      CIPHER_GEMINI_BASE=http://127.0.0.1:8089/v1beta/models streamlit run OneDrive/Desktop/cipher/cipher_app.py
+
+Answers are deterministic: questions about a known concept are answered from its
+fact table (ITEMS in cipher_game.py), anything else from a stable hash. Latency and
+error injection are configurable:
+- CIPHER_FAKE_LATENCY      "fixed:0.3", "uniform:0.2,1.5", "normal:0.8,0.2" or
+                           "lognormal:0.8,0.5" (median seconds, sigma)
+- CIPHER_FAKE_TOKEN_SECONDS extra seconds per output token (default 0.002)
+- CIPHER_FAKE_429_RATE     share of calls answered with 429 RESOURCE_EXHAUSTED
+- CIPHER_FAKE_ERROR_RATE   share of calls answered with 503/500
+- CIPHER_FAKE_SEED         seed for latency and error draws
+"""
+import argparse
+import ast
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+GAME_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cipher_game.py')
+
+# ─────────────────────────────────────────────
+#  ERRORS (named like google.api_core.exceptions)
+# ─────────────────────────────────────────────
+
+class FakeGeminiError(Exception):
+    code = 500
+    status = "INTERNAL"
+
+class ResourceExhausted(FakeGeminiError):
+    code = 429
+    status = "RESOURCE_EXHAUSTED"
+
+class InternalServerError(FakeGeminiError):
+    code = 500
+    status = "INTERNAL"
+
+class ServiceUnavailable(FakeGeminiError):
+    code = 503
+    status = "UNAVAILABLE"
+
+class DeadlineExceeded(FakeGeminiError):
+    code = 504
+    status = "DEADLINE_EXCEEDED"
+
+# ─────────────────────────────────────────────
+#  LATENCY & FAULT INJECTION
+# ─────────────────────────────────────────────
+
+class LatencyModel:
+    """Samples call latency from a distribution spec such as "lognormal:0.8,0.5"."""
+
+    def __init__(self, spec: str = "lognormal:0.6,0.4", token_seconds: float = 0.002, seed=None):
+        kind, _, args = spec.partition(':')
+        self.kind = kind.strip().lower()
+        self.args = [float(a) for a in args.split(',') if a.strip()]
+        if self.kind not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+        self.spec = spec
+        self.token_seconds = token_seconds
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self, output_tokens: int = 0) -> float:
+        with self._lock:
+            if self.kind == "fixed":
+                base = self.args[0]
+            elif self.kind == "uniform":
+                base = self._rng.uniform(self.args[0], self.args[1])
+            elif self.kind == "normal":
+                base = self._rng.gauss(self.args[0], self.args[1])
+            else:
+                base = self._rng.lognormvariate(math.log(self.args[0]), self.args[1])
+        return max(0.0, base) + output_tokens * self.token_seconds
+
+class FaultInjector:
+    """Raises 429 / 5xx errors at configured rates."""
+
+    def __init__(self, rate_429: float = 0.0, error_rate: float = 0.0, seed=None):
+        self.rate_429 = rate_429
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def maybe_fail(self):
+        with self._lock:
+            roll = self._rng.random()
+            kind = self._rng.random()
+        if roll < self.rate_429:
+            raise ResourceExhausted("Resource has been exhausted (e.g. check quota).")
+        if roll < self.rate_429 + self.error_rate:
+            if kind < 0.7:
+                raise ServiceUnavailable("The model is overloaded. Please try again later.")
+            raise InternalServerError("An internal error has occurred.")
+
+# ─────────────────────────────────────────────
+#  DETERMINISTIC ANSWERS
+# ─────────────────────────────────────────────
+
+FACT_FILLER = {"is", "a", "an", "the"}
+
+def load_game_concepts(path: str = GAME_FILE) -> list:
+    """Read the ITEMS literal out of cipher_game.py without importing it (no Flask/genai needed)."""
+    try:
+        with open(path) as f:
+            tree = ast.parse(f.read())
+    except (OSError, SyntaxError):
+        return []
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and getattr(node.targets[0], 'id', None) == 'ITEMS':
+            items = ast.literal_eval(node.value)
+            return [dict(item, difficulty=difficulty) for difficulty, group in items.items() for item in group]
+    return []
+
+def _key(text: str) -> str:
+    return ''.join(re.findall(r"[a-z0-9]+", text.lower()))
+
+def _stable_roll(*parts) -> float:
+    digest = hashlib.sha256('|'.join(parts).encode()).hexdigest()
+    return int(digest[:8], 16) / 0xFFFFFFFF
+
+def fact_question(fact: str) -> str:
+    """'is_malicious' -> 'Is it malicious?', 'involves_computers' -> 'Does it involve computers?'"""
+    words = fact.split('_')
+    if words[0] == 'is':
+        return f"Is it {' '.join(words[1:])}?"
+    verb = words[0][:-1] if words[0].endswith('s') else words[0]
+    return f"Does it {' '.join([verb] + words[1:])}?"
+
+class KnowledgeBase:
+    """Concepts by name, and the rules that turn a prompt's question into a fact lookup."""
+
+    def __init__(self, concepts: list):
+        self.concepts = list(concepts)
+        self.by_key = {_key(c['name']): c for c in self.concepts}
+        self._served = 0
+        self._lock = threading.Lock()
+
+    def find(self, name: str):
+        return self.by_key.get(_key(name))
+
+    def answer(self, name: str, question: str) -> str:
+        words = re.findall(r"[a-z0-9]+", question.lower())
+        if not words:
+            return "Irrelevant"
+        negated = "not" in words or "n't" in question.lower()
+        concept = self.find(name)
+        for fact, value in (concept or {}).get('facts', {}).items():
+            needed = [w for w in fact.split('_') if w not in FACT_FILLER]
+            if needed and all(any(w.startswith(n[:5]) for w in words) for n in needed):
+                return "Yes" if bool(value) != negated else "No"
+        return "Yes" if _stable_roll(_key(name), ' '.join(words)) < 0.35 else "No"
+
+    def is_correct(self, name: str, guess: str) -> bool:
+        concept = self.find(name) or {"name": name}
+        accepted = {_key(concept['name'])} | {_key(a) for a in concept.get('aliases', [])}
+        words = re.findall(r"[A-Za-z0-9]+", concept['name'])
+        if len(words) > 2:
+            accepted.add(''.join(w[0] for w in words).lower())
+        return _key(guess) in accepted
+
+    def pick(self, difficulty: str = "", exclude=()) -> dict:
+        excluded = {_key(n) for n in exclude}
+        pool = [c for c in self.concepts if c.get('difficulty', '') == difficulty.lower()] or self.concepts
+        pool = [c for c in pool if _key(c['name']) not in excluded] or pool
+        with self._lock:
+            self._served += 1
+            return pool[self._served % len(pool)]
+
+# ─────────────────────────────────────────────
+#  PROMPT ROUTING
+# ─────────────────────────────────────────────
+
+def _quoted(prompt: str, label: str) -> str:
+    match = re.search(re.escape(label) + r'\s*"([^"]*)"', prompt)
+    return match.group(1) if match else ""
+
+def _line(prompt: str, label: str) -> str:
+    match = re.search(re.escape(label) + r"\s*(.+)", prompt)
+    return match.group(1).strip() if match else ""
+
+def _json_block(prompt: str, label: str):
+    start = prompt.find(label)
+    if start < 0:
+        return None
+    try:
+        return json.JSONDecoder().raw_decode(prompt[start + len(label):].lstrip())[0]
+    except ValueError:
+        return None
+
+def respond(kb: KnowledgeBase, prompt: str) -> str:
+    """Recognize which of the two apps' prompts this is and answer it the way Gemini would."""
+    # cipher_game.py prompts
+    if "PLAYER'S QUESTION:" in prompt:
+        return kb.answer(_line(prompt, "THE CONCEPT:"), _quoted(prompt, "PLAYER'S QUESTION:"))
+    if "ENTRIES:" in prompt:
+        entries = _json_block(prompt, "ENTRIES:") or []
+        return json.dumps([{"id": e["id"], "answer": kb.answer(e["concept"], e["question"])} for e in entries])
+    if "The PLAYER'S GUESS is:" in prompt:
+        correct = kb.is_correct(_line(prompt, "The CORRECT ANSWER is:"), _quoted(prompt, "The PLAYER'S GUESS is:"))
+        return "CORRECT" if correct else "INCORRECT"
+    if "CONCEPTS:" in prompt:
+        names = _json_block(prompt, "CONCEPTS:") or []
+        return json.dumps({name: (kb.find(name) or {}).get('aliases', []) for name in names})
+    if "Generate a unique cybersecurity concept" in prompt:
+        excluded = _line(prompt, "DO NOT USE these recently used concepts:").split(', ')
+        concept = kb.pick(_line(prompt, "DIFFICULTY:"), excluded)
+        return json.dumps({
+            "name": concept['name'],
+            "category": concept.get('category', "cybersecurity"),
+            "description": concept['description'],
+            "aliases": concept.get('aliases', []),
+            "facts": concept.get('facts', {}),
+        })
+
+    # cipher_app.py prompts
+    if "Select ONE specific subject" in prompt:
+        concept = kb.pick(_line(prompt, "Difficulty:").split('.')[0])
+        facts = list(concept.get('facts', {}))
+        return json.dumps({
+            "name": concept['name'],
+            "category": _quoted(prompt, "category:"),
+            "difficulty": _line(prompt, "Difficulty:").split('.')[0],
+            "description": concept['description'],
+            "fun_fact": f"{concept['name']} is served by the offline Gemini stand-in.",
+            "aliases": concept.get('aliases', []),
+            "optimal_first_questions": [fact_question(f) for f in facts[:5]],
+        })
+    if "Player's question:" in prompt:
+        answer = kb.answer(_quoted(prompt, "Secret subject:"), _quoted(prompt, "Player's question:"))
+        return json.dumps({"answer": answer, "brief_reason": "From the fact table"})
+    if "Player's guess:" in prompt:
+        correct = kb.is_correct(_quoted(prompt, "Secret:"), _quoted(prompt, "Player's guess:"))
+        return json.dumps({"correct": correct, "reason": "Exact or alias match" if correct else "Different concept"})
+    if "Generate 12 NEW" in prompt:
+        concept = kb.find(_quoted(prompt, "Secret:")) or kb.concepts[0]
+        return json.dumps({"questions": [fact_question(f) for f in list(concept.get('facts', {}))[:12]]})
+    if "Generate hint #" in prompt:
+        name = _quoted(prompt, "Secret:")
+        level = int(re.search(r"Generate hint #(\d+)", prompt).group(1))
+        return json.dumps({"hint": f"It has {len(name)} characters and starts with '{name[:1]}'", "hint_level": level})
+    if "OPTIMAL questions" in prompt:
+        name = _quoted(prompt, "Secret:")
+        concept = kb.find(name) or {"facts": {}}
+        steps = [
+            {"step": i + 1, "question": fact_question(fact), "expected_answer": "Yes" if value else "No",
+             "why": "Splits the remaining concepts"}
+            for i, (fact, value) in enumerate(list(concept['facts'].items())[:8])
+        ]
+        return json.dumps({"optimal_path": steps, "strategy_tip": "Ask about broad properties before specifics."})
+    return "Irrelevant"
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+# ─────────────────────────────────────────────
+#  FAKE GEMINI
+# ─────────────────────────────────────────────
+
+class FakeGemini:
+    """Shared engine behind both the in-process model and the HTTP server."""
+
+    def __init__(self, latency: LatencyModel = None, faults: FaultInjector = None, concepts: list = None):
+        seed = os.environ.get('CIPHER_FAKE_SEED')
+        self.latency = latency or LatencyModel(
+            os.environ.get('CIPHER_FAKE_LATENCY', "lognormal:0.6,0.4"),
+            token_seconds=float(os.environ.get('CIPHER_FAKE_TOKEN_SECONDS', 0.002)),
+            seed=seed
+        )
+        self.faults = faults or FaultInjector(
+            rate_429=float(os.environ.get('CIPHER_FAKE_429_RATE', 0)),
+            error_rate=float(os.environ.get('CIPHER_FAKE_ERROR_RATE', 0)),
+            seed=seed
+        )
+        self.kb = KnowledgeBase(concepts if concepts is not None else load_game_concepts())
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+
+    def generate(self, prompt: str, timeout: float = None):
+        """Sleep for a sampled latency, maybe fail, and return (text, usage)."""
+        with self._lock:
+            self.calls += 1
+        text = respond(self.kb, prompt)
+        delay = self.latency.sample(estimate_tokens(text))
+        try:
+            if timeout is not None and delay > timeout:
+                time.sleep(timeout)
+                raise DeadlineExceeded(f"Deadline of {timeout:.2f}s exceeded")
+            time.sleep(delay)
+            self.faults.maybe_fail()
+        except FakeGeminiError:
+            with self._lock:
+                self.errors += 1
+            raise
+        usage = {
+            "promptTokenCount": estimate_tokens(prompt),
+            "candidatesTokenCount": estimate_tokens(text),
+            "totalTokenCount": estimate_tokens(prompt) + estimate_tokens(text),
+        }
+        return text, usage
+
+# ─────────────────────────────────────────────
+#  IN-PROCESS `genai` REPLACEMENT
+# ─────────────────────────────────────────────
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def _get_engine() -> FakeGemini:
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = FakeGemini()
+        return _engine
+
+def configure(api_key: str = None, **kwargs):
+    """Accepted for API compatibility; the fake needs no key."""
+
+class FakeResponse:
+    def __init__(self, text: str, usage: dict):
+        self.text = text
+        self.usage_metadata = SimpleNamespace(
+            prompt_token_count=usage["promptTokenCount"],
+            candidates_token_count=usage["candidatesTokenCount"],
+            total_token_count=usage["totalTokenCount"]
+        )
+
+class GenerativeModel:
+    """Drop-in for genai.GenerativeModel covering generate_content (plain and streamed)."""
+
+    def __init__(self, model_name: str = "gemini-2.5-flash", engine: FakeGemini = None, **kwargs):
+        self.model_name = model_name
+        self.engine = engine or _get_engine()
+
+    def generate_content(self, prompt, generation_config=None, request_options=None, stream=False, **kwargs):
+        timeout = (request_options or {}).get("timeout")
+        text, usage = self.engine.generate(str(prompt), timeout=timeout)
+        if not stream:
+            return FakeResponse(text, usage)
+        # One chunk per word, like a token stream
+        pieces = re.findall(r"\S+\s*", text) or [text]
+        return iter([FakeResponse(piece, usage) for piece in pieces])
+
+# ─────────────────────────────────────────────
+#  HTTP SERVER (:generateContent REST shape)
+# ─────────────────────────────────────────────
+
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    engine = None
+
+    def do_POST(self):
+        if not re.search(r"/models/[^/:]+:generateContent$", self.path.split('?')[0]):
+            return self._send(404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}})
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b"{}")
+            parts = [p.get("text", "") for c in payload.get("contents", []) for p in c.get("parts", [])]
+        except (ValueError, AttributeError):
+            return self._send(400, {"error": {"code": 400, "message": "Invalid JSON payload", "status": "INVALID_ARGUMENT"}})
+        try:
+            text, usage = self.engine.generate("\n".join(parts))
+        except FakeGeminiError as e:
+            return self._send(e.code, {"error": {"code": e.code, "message": str(e), "status": e.status}})
+        self._send(200, {
+            "candidates": [{
+                "content": {"role": "model", "parts": [{"text": text}]},
+                "finishReason": "STOP",
+                "index": 0
+            }],
+            "usageMetadata": usage
+        })
+
+    def _send(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(host: str = "127.0.0.1", port: int = 8089, engine: FakeGemini = None) -> ThreadingHTTPServer:
+    handler = type("Handler", (FakeGeminiHandler,), {"engine": engine or _get_engine()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Offline Gemini stand-in for load and latency testing")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', default=os.environ.get('CIPHER_FAKE_LATENCY', "lognormal:0.6,0.4"),
+                        help='fixed:S | uniform:LO,HI | normal:MEAN,SD | lognormal:MEDIAN,SIGMA')
+    parser.add_argument('--rate-429', type=float, default=float(os.environ.get('CIPHER_FAKE_429_RATE', 0)))
+    parser.add_argument('--error-rate', type=float, default=float(os.environ.get('CIPHER_FAKE_ERROR_RATE', 0)))
+    parser.add_argument('--seed', default=os.environ.get('CIPHER_FAKE_SEED'))
+    args = parser.parse_args()
+
+    engine = FakeGemini(
+        latency=LatencyModel(args.latency, float(os.environ.get('CIPHER_FAKE_TOKEN_SECONDS', 0.002)), args.seed),
+        faults=FaultInjector(args.rate_429, args.error_rate, args.seed)
+    )
+    print(f"[FAKE GEMINI] {len(engine.kb.concepts)} concepts, latency {args.latency}, "
+          f"429 rate {args.rate_429}, error rate {args.error_rate}")
+    print(f"[FAKE GEMINI] Listening on http://{args.host}:{args.port}/v1beta/models")
+    serve(args.host, args.port, engine).serve_forever()
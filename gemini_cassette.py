@@ -0,0 +1,414 @@
+"""
+GEMINI RECORD / REPLAY CASSETTES
+
+Captures every Gemini interaction into a cassette (JSONL plus a hash index) and
+serves them back later, for reproducible benchmarks and regression runs.
+
+- cipher_game.py (generate_content):
+      CIPHER_CASSETTE=game.jsonl CIPHER_CASSETTE_MODE=record python cipher_game.py
+      CIPHER_CASSETTE=game.jsonl CIPHER_CASSETTE_MODE=replay CIPHER_CASSETTE_LATENCY=zero python cipher_game.py
+  Record mode also logs every API request the Flask app serves, so the whole game
+  stream can be replayed through the endpoints at full speed:
+      python gemini_cassette.py replay-game game.jsonl
+- cipher_app.py (gemini_chat, REST) via a recording/replaying proxy:
+      python gemini_cassette.py proxy app.jsonl --mode record --port 8090
+      CIPHER_GEMINI_BASE=http://127.0.0.1:8090/v1beta/models streamlit run OneDrive/Desktop/cipher/cipher_app.py
+
+Requests are matched by a hash of (model, prompt, generation config). Identical
+requests recorded several times are replayed in their recorded order.
+"""
+import argparse
+import atexit
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import fake_gemini
+
+GEMINI_BASE = "https://generativelanguage.googleapis.com/v1beta/models"
+
+class CassetteMissError(KeyError):
+    """Replay mode got a request that isn't on the cassette."""
+
+def request_hash(model: str, prompt: str, config: dict) -> str:
+    key = json.dumps({"model": model, "prompt": prompt, "config": config or {}}, sort_keys=True, default=str)
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+# ─────────────────────────────────────────────
+#  CASSETTE FILE
+# ─────────────────────────────────────────────
+
+class Cassette:
+    """
+    One JSON object per line: "gemini" entries keyed by request hash, and
+    "http" entries (the Flask requests of a recorded game stream) in order.
+    The index (`<path>.idx`) maps each hash to its line offsets so replay
+    only parses the entries it serves.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.index_path = path + '.idx'
+        self._lock = threading.Lock()
+        self._cursors = defaultdict(int)
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+        self._load_index()
+        atexit.register(self.save_index)
+
+    def _load_index(self):
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+            if index.get("size") == size:
+                self.gemini = defaultdict(list, index["gemini"])
+                self.http = index["http"]
+                return
+        except (OSError, ValueError, KeyError):
+            pass
+        # Missing or stale index: rebuild it with one pass over the cassette
+        self.gemini, self.http = defaultdict(list), []
+        if size:
+            with open(self.path, 'rb') as f:
+                offset = 0
+                for line in f:
+                    entry = json.loads(line)
+                    if entry.get("kind") == "http":
+                        self.http.append(offset)
+                    else:
+                        self.gemini[entry["hash"]].append(offset)
+                    offset += len(line)
+
+    def save_index(self):
+        with self._lock:
+            size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+            with open(self.index_path, 'w') as f:
+                json.dump({"size": size, "gemini": self.gemini, "http": self.http}, f, separators=(',', ':'))
+
+    def _read(self, offset: int) -> dict:
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+    def record(self, entry: dict):
+        line = (json.dumps(entry, separators=(',', ':'), default=str) + '\n').encode()
+        with self._lock:
+            with open(self.path, 'ab') as f:
+                offset = f.tell()
+                f.write(line)
+            if entry.get("kind") == "http":
+                self.http.append(offset)
+            else:
+                self.gemini[entry["hash"]].append(offset)
+            self.recorded += 1
+            flush = self.recorded % 50 == 0
+        if flush:
+            self.save_index()
+
+    def lookup(self, key: str) -> dict:
+        """Next recorded response for this request hash (cycling once all have been served)."""
+        with self._lock:
+            offsets = self.gemini.get(key)
+            if not offsets:
+                self.misses += 1
+                raise CassetteMissError(key)
+            offset = offsets[self._cursors[key] % len(offsets)]
+            self._cursors[key] += 1
+            self.hits += 1
+        return self._read(offset)
+
+    def interactions(self) -> list:
+        return [self._read(offset) for offset in self.http]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "path": self.path,
+                "requests": len(self.gemini),
+                "http_interactions": len(self.http),
+                "recorded": self.recorded,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+def gemini_entry(key: str, model: str, prompt: str, config: dict, text: str, usage: dict,
+                 seconds: float, error: Exception = None) -> dict:
+    entry = {
+        "kind": "gemini",
+        "hash": key,
+        "model": model,
+        "prompt": prompt,
+        "config": config or {},
+        "text": text,
+        "usage": usage,
+        "latency_ms": round(seconds * 1000, 1)
+    }
+    if error is not None:
+        entry["error"] = {"type": type(error).__name__, "code": getattr(error, 'code', None), "message": str(error)}
+    return entry
+
+def replay_error(error: dict) -> Exception:
+    """Rebuild a recorded failure as the fake_gemini error of the same name (429 stays a 429)."""
+    cls = getattr(fake_gemini, error.get("type", ""), None)
+    if not (isinstance(cls, type) and issubclass(cls, fake_gemini.FakeGeminiError)):
+        cls = type(error.get("type") or "FakeGeminiError", (fake_gemini.FakeGeminiError,), {})
+    exc = cls(error.get("message", ""))
+    if isinstance(error.get("code"), int):
+        exc.code = error["code"]
+    return exc
+
+def _usage_dict(response) -> dict:
+    usage = getattr(response, 'usage_metadata', None)
+    return {
+        "promptTokenCount": getattr(usage, 'prompt_token_count', 0),
+        "candidatesTokenCount": getattr(usage, 'candidates_token_count', 0),
+        "totalTokenCount": getattr(usage, 'total_token_count', 0)
+    }
+
+# ─────────────────────────────────────────────
+#  generate_content WRAPPERS (cipher_game.py)
+# ─────────────────────────────────────────────
+
+class RecordingModel:
+    """Passes calls through to the real model and records each one."""
+
+    def __init__(self, model, cassette: Cassette, model_name: str):
+        self.model = model
+        self.cassette = cassette
+        self.model_name = model_name
+
+    def generate_content(self, prompt, generation_config=None, stream=False, **kwargs):
+        key = request_hash(self.model_name, str(prompt), generation_config)
+        start = time.time()
+        try:
+            response = self.model.generate_content(prompt, generation_config=generation_config, stream=stream, **kwargs)
+        except Exception as e:
+            self.cassette.record(gemini_entry(key, self.model_name, str(prompt), generation_config, "", {},
+                                              time.time() - start, error=e))
+            raise
+        if not stream:
+            self.cassette.record(gemini_entry(key, self.model_name, str(prompt), generation_config,
+                                              response.text, _usage_dict(response), time.time() - start))
+            return response
+        return self._record_stream(key, str(prompt), generation_config, response, start)
+
+    def _record_stream(self, key, prompt, generation_config, response, start):
+        # Recorded once the stream is drained (or abandoned) with the text seen so far
+        text, last = "", None
+        try:
+            for chunk in response:
+                last = chunk
+                try:
+                    text += chunk.text
+                except ValueError:
+                    pass
+                yield chunk
+        finally:
+            usage = _usage_dict(last) if last is not None else {}
+            self.cassette.record(gemini_entry(key, self.model_name, prompt, generation_config,
+                                              text, usage, time.time() - start))
+
+class ReplayModel:
+    """Serves generate_content from a cassette, at the recorded latency or none at all."""
+
+    def __init__(self, cassette: Cassette, model_name: str, latency: str = "recorded"):
+        self.cassette = cassette
+        self.model_name = model_name
+        self.latency = latency
+
+    def generate_content(self, prompt, generation_config=None, request_options=None, stream=False, **kwargs):
+        entry = self.cassette.lookup(request_hash(self.model_name, str(prompt), generation_config))
+        if self.latency == "recorded":
+            delay = entry.get("latency_ms", 0) / 1000
+            timeout = (request_options or {}).get("timeout")
+            if timeout is not None and delay > timeout:
+                time.sleep(timeout)
+                raise fake_gemini.DeadlineExceeded(f"Deadline of {timeout:.2f}s exceeded")
+            time.sleep(delay)
+        if entry.get("error"):
+            raise replay_error(entry["error"])
+        usage = {"promptTokenCount": 0, "candidatesTokenCount": 0, "totalTokenCount": 0, **entry.get("usage", {})}
+        if not stream:
+            return fake_gemini.FakeResponse(entry["text"], usage)
+        return iter([fake_gemini.FakeResponse(entry["text"], usage)])
+
+def wrap_model(model, cassette: Cassette, mode: str, model_name: str, latency: str = "recorded"):
+    if mode == "record":
+        return RecordingModel(model, cassette, model_name)
+    if mode == "replay":
+        return ReplayModel(cassette, model_name, latency)
+    raise ValueError(f"Unknown cassette mode: {mode}")
+
+# ─────────────────────────────────────────────
+#  REST PROXY (cipher_app.py)
+# ─────────────────────────────────────────────
+
+def rest_prompt(payload: dict) -> str:
+    system = " ".join(p.get("text", "") for p in payload.get("system_instruction", {}).get("parts", []))
+    contents = "\n".join(p.get("text", "") for c in payload.get("contents", []) for p in c.get("parts", []))
+    return f"{system}\n\n{contents}" if system else contents
+
+class CassetteProxyHandler(BaseHTTPRequestHandler):
+    cassette = None
+    mode = "replay"
+    latency = "recorded"
+    upstream = GEMINI_BASE
+
+    def do_POST(self):
+        path, _, query = self.path.partition('?')
+        model = path.rstrip('/').rsplit('/', 1)[-1].split(':')[0]
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            return self._send(400, {"error": {"code": 400, "message": "Invalid JSON payload", "status": "INVALID_ARGUMENT"}})
+        prompt, config = rest_prompt(payload), payload.get("generationConfig", {})
+        key = request_hash(model, prompt, config)
+
+        if self.mode == "record":
+            status, data, seconds = self._forward(model, query, body)
+            candidates = data.get("candidates") or [{}]
+            parts = candidates[0].get("content", {}).get("parts") or [{}]
+            error = None
+            if status != 200:
+                error = fake_gemini.FakeGeminiError(data.get("error", {}).get("message", ""))
+                error.code = status
+            self.cassette.record(gemini_entry(key, model, prompt, config, parts[0].get("text", ""),
+                                              data.get("usageMetadata", {}), seconds, error=error))
+            return self._send(status, data)
+
+        try:
+            entry = self.cassette.lookup(key)
+        except CassetteMissError:
+            return self._send(404, {"error": {"code": 404, "message": f"Not on cassette: {key}", "status": "NOT_FOUND"}})
+        if self.latency == "recorded":
+            time.sleep(entry.get("latency_ms", 0) / 1000)
+        if entry.get("error"):
+            code = entry["error"].get("code") or 500
+            return self._send(code, {"error": {"code": code, "message": entry["error"].get("message", "")}})
+        self._send(200, {
+            "candidates": [{"content": {"role": "model", "parts": [{"text": entry["text"]}]},
+                            "finishReason": "STOP", "index": 0}],
+            "usageMetadata": entry.get("usage", {})
+        })
+
+    def _forward(self, model: str, query: str, body: bytes):
+        url = f"{self.upstream}/{model}:generateContent?{query}"
+        req = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+        start = time.time()
+        try:
+            with urllib.request.urlopen(req, timeout=60) as resp:
+                return resp.status, json.loads(resp.read()), time.time() - start
+        except urllib.error.HTTPError as e:
+            try:
+                data = json.loads(e.read())
+            except ValueError:
+                data = {"error": {"code": e.code, "message": str(e)}}
+            return e.code, data, time.time() - start
+
+    def _send(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve_proxy(cassette: Cassette, mode: str, latency: str = "recorded", upstream: str = GEMINI_BASE,
+                host: str = "127.0.0.1", port: int = 8090) -> ThreadingHTTPServer:
+    handler = type("Handler", (CassetteProxyHandler,), {
+        "cassette": cassette, "mode": mode, "latency": latency, "upstream": upstream.rstrip('/')
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+# ─────────────────────────────────────────────
+#  GAME STREAM REPLAY (Flask endpoints)
+# ─────────────────────────────────────────────
+
+def replay_game(path: str, latency: str = "zero") -> dict:
+    """
+    Replay a recorded game stream through cipher_game's Flask endpoints with the
+    Gemini side served from the same cassette. Returns throughput and mismatches.
+    """
+    os.environ['CIPHER_CASSETTE'] = path
+    os.environ['CIPHER_CASSETTE_MODE'] = 'replay'
+    os.environ['CIPHER_CASSETTE_LATENCY'] = latency
+    # The recorded run already paid the quota; don't let the scheduler pace the replay
+    os.environ.setdefault('CIPHER_GEMINI_RPM', '1000000000')
+    os.environ.setdefault('CIPHER_GEMINI_TPM', '1000000000000')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import cipher_game
+
+    client = cipher_game.app.test_client()
+    interactions = cipher_game.GEMINI_CASSETTE.interactions()
+    mismatches = []
+    start = time.time()
+    for i, entry in enumerate(interactions):
+        response = client.open(
+            entry["path"], method=entry["method"], json=entry.get("body"),
+            headers={"User-Agent": entry.get("user_agent", "")},
+            environ_base={"REMOTE_ADDR": entry.get("remote_addr") or "127.0.0.1"}
+        )
+        response.get_data()
+        if entry.get("concept") and response.is_json:
+            # Pin the concept the recorded game was played against
+            session = cipher_game.sessions.get(response.get_json().get("session_id"))
+            if session is not None:
+                session["item"] = entry["concept"]
+        if response.status_code != entry.get("status"):
+            mismatches.append({"index": i, "path": entry["path"], "recorded": entry.get("status"),
+                               "replayed": response.status_code})
+    elapsed = time.time() - start
+    return {
+        "requests": len(interactions),
+        "seconds": round(elapsed, 3),
+        "rps": round(len(interactions) / elapsed, 1) if elapsed else 0.0,
+        "status_mismatches": mismatches,
+        "cassette": cipher_game.GEMINI_CASSETTE.stats()
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Record/replay cassettes for Gemini interactions")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    proxy = commands.add_parser('proxy', help="recording/replaying :generateContent proxy for cipher_app.py")
+    proxy.add_argument('cassette')
+    proxy.add_argument('--mode', choices=['record', 'replay'], default='replay')
+    proxy.add_argument('--latency', choices=['recorded', 'zero'], default='recorded')
+    proxy.add_argument('--upstream', default=os.environ.get('CIPHER_GEMINI_BASE', GEMINI_BASE))
+    proxy.add_argument('--host', default="127.0.0.1")
+    proxy.add_argument('--port', type=int, default=8090)
+
+    game = commands.add_parser('replay-game', help="replay a recorded cipher_game stream through its endpoints")
+    game.add_argument('cassette')
+    game.add_argument('--latency', choices=['recorded', 'zero'], default='zero')
+
+    info = commands.add_parser('info', help="summarize a cassette")
+    info.add_argument('cassette')
+    args = parser.parse_args()
+
+    if args.command == 'proxy':
+        cassette = Cassette(args.cassette)
+        print(f"[CASSETTE] {args.mode} {args.cassette} on http://{args.host}:{args.port}/v1beta/models")
+        try:
+            serve_proxy(cassette, args.mode, args.latency, args.upstream, args.host, args.port).serve_forever()
+        except KeyboardInterrupt:
+            pass
+    elif args.command == 'replay-game':
+        print(json.dumps(replay_game(args.cassette, args.latency), indent=2))
+    else:
+        print(json.dumps(Cassette(args.cassette).stats(), indent=2))
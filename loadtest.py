@@ -0,0 +1,261 @@
+"""
+END-TO-END LOAD TEST
+
+Drives realistic game flows against the Flask API with many concurrent virtual
+players: start, N questions, hints, guesses, then the leaderboard. Each player
+sends its own User-Agent, so get_session_id gives it its own session.
+
+    # Against a running server
+    python loadtest.py --url http://127.0.0.1:5000 --players 50 --duration 60
+
+    # Fully offline: serve cipher_game.py in-process on the Gemini stand-in
+    CIPHER_FAKE_LATENCY=lognormal:0.8,0.5 python loadtest.py --spawn --players 50 --duration 60
+
+Reports requests/sec and p50/p95/p99 latency and error rates per endpoint, as a
+table and (with --json) as JSON.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+QUESTION_BANK = [
+    "Is it malicious?",
+    "Is it an attack?",
+    "Does it involve computers?",
+    "Is it defensive?",
+    "Does it require the internet?",
+    "Is it a tool?",
+    "Is it a protocol?",
+    "Does it involve deception?",
+    "Does it target individuals?",
+    "Does it target organizations?",
+    "Is it automated?",
+    "Did it exist before 2000?",
+    "Is it illegal?",
+    "Is it widely known?",
+    "Is it network based?",
+    "Does it involve email?",
+    "Does it involve human error?",
+    "Is it related to encryption?",
+    "Was it created by a government?",
+    "Does it spread on its own?",
+    "Is it used by penetration testers?",
+    "Does it exploit software bugs?",
+    "Is it related to passwords?",
+    "Does it affect hardware?",
+]
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+# ─────────────────────────────────────────────
+#  RESULTS
+# ─────────────────────────────────────────────
+
+class Results:
+    """Latency samples and outcome counts per endpoint, shared by all players."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.statuses = {}
+        self.games = 0
+        self.wins = 0
+
+    def add(self, endpoint: str, status: int, seconds: float):
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(seconds)
+            codes = self.statuses.setdefault(endpoint, {})
+            codes[status] = codes.get(status, 0) + 1
+
+    def finish_game(self, won: bool):
+        with self._lock:
+            self.games += 1
+            self.wins += int(won)
+
+    def report(self, elapsed: float) -> dict:
+        with self._lock:
+            endpoints = {}
+            for endpoint, samples in sorted(self.latencies.items()):
+                codes = self.statuses[endpoint]
+                count = len(samples)
+                server_errors = sum(n for code, n in codes.items() if code == 0 or code >= 500)
+                client_errors = sum(n for code, n in codes.items() if 400 <= code < 500)
+                endpoints[endpoint] = {
+                    "requests": count,
+                    "rps": round(count / elapsed, 2) if elapsed else 0.0,
+                    "p50_ms": round(percentile(samples, 50) * 1000, 1),
+                    "p95_ms": round(percentile(samples, 95) * 1000, 1),
+                    "p99_ms": round(percentile(samples, 99) * 1000, 1),
+                    "max_ms": round(max(samples) * 1000, 1),
+                    "error_rate": round(server_errors / count, 4),
+                    "client_error_rate": round(client_errors / count, 4),
+                    "status_codes": {str(code): n for code, n in sorted(codes.items())}
+                }
+            total = sum(e["requests"] for e in endpoints.values())
+            errors = sum(e["error_rate"] * e["requests"] for e in endpoints.values())
+            return {
+                "duration_s": round(elapsed, 2),
+                "requests": total,
+                "rps": round(total / elapsed, 2) if elapsed else 0.0,
+                "error_rate": round(errors / total, 4) if total else 0.0,
+                "games": self.games,
+                "wins": self.wins,
+                "endpoints": endpoints
+            }
+
+def print_table(report: dict):
+    header = f"{'endpoint':<26}{'reqs':>7}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'err %':>8}{'4xx %':>8}"
+    print(header)
+    print("─" * len(header))
+    for endpoint, e in report["endpoints"].items():
+        print(f"{endpoint:<26}{e['requests']:>7}{e['rps']:>9.1f}{e['p50_ms']:>9.1f}{e['p95_ms']:>9.1f}"
+              f"{e['p99_ms']:>9.1f}{e['error_rate'] * 100:>8.2f}{e['client_error_rate'] * 100:>8.2f}")
+    print("─" * len(header))
+    print(f"{report['requests']} requests in {report['duration_s']}s · {report['rps']} req/s · "
+          f"{report['error_rate'] * 100:.2f}% errors · {report['games']} games ({report['wins']} won)")
+
+# ─────────────────────────────────────────────
+#  VIRTUAL PLAYERS
+# ─────────────────────────────────────────────
+
+class VirtualPlayer:
+    """One browser: plays whole games back to back until told to stop."""
+
+    def __init__(self, player_id: int, base_url: str, results: Results, args, concept_names: list):
+        self.base_url = base_url.rstrip('/')
+        self.results = results
+        self.args = args
+        self.concept_names = concept_names
+        self.name = f"loadtest-{player_id}"
+        self.user_agent = f"CipherLoadTest/1.0 (player {player_id})"
+        self.rng = random.Random(f"{args.seed}-{player_id}")
+
+    def call(self, method: str, path: str, body: dict = None, label: str = None):
+        label = label or f"{method} {path}"
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method, headers={
+            "User-Agent": self.user_agent,
+            "Content-Type": "application/json"
+        })
+        start = time.time()
+        try:
+            with urllib.request.urlopen(req, timeout=self.args.timeout) as resp:
+                status, payload = resp.status, resp.read()
+        except urllib.error.HTTPError as e:
+            status, payload = e.code, e.read()
+        except OSError:
+            status, payload = 0, b""
+        self.results.add(label, status, time.time() - start)
+        if path.endswith('/stream'):
+            # Last SSE event carries the final result
+            events = [line[6:] for line in payload.decode(errors='replace').splitlines() if line.startswith("data: ")]
+            payload = events[-1].encode() if events else b""
+        try:
+            return status, json.loads(payload) if payload else {}
+        except ValueError:
+            return status, {}
+
+    def play_game(self):
+        self.call("POST", "/api/start", {"difficulty": self.rng.choice(self.args.difficulties), "use_ai": self.args.use_ai})
+        question_path = "/api/question/stream" if self.args.stream else "/api/question"
+        for question in self.rng.sample(QUESTION_BANK, min(self.args.questions, len(QUESTION_BANK))):
+            self.call("POST", question_path, {"question_text": question})
+            self.think()
+        for _ in range(self.args.hints):
+            self.call("POST", "/api/hint", {})
+        won = False
+        guess_path = "/api/guess/stream" if self.args.stream else "/api/guess"
+        for guess in self.rng.sample(self.concept_names, min(3, len(self.concept_names))):
+            status, result = self.call("POST", guess_path, {"guess": guess, "player_name": self.name})
+            won = won or bool(result.get("correct"))
+            if status != 200 or result.get("game_over") or won:
+                break
+            self.think()
+        self.call("GET", "/api/leaderboard")
+        self.results.finish_game(won)
+
+    def think(self):
+        if self.args.think_time:
+            time.sleep(self.rng.uniform(0, self.args.think_time))
+
+    def run(self, stop_at: float, games: int):
+        played = 0
+        while time.time() < stop_at and (not games or played < games):
+            self.play_game()
+            played += 1
+
+# ─────────────────────────────────────────────
+#  OFFLINE SERVER
+# ─────────────────────────────────────────────
+
+def spawn_server(port: int):
+    """Serve cipher_game.py in-process on the offline Gemini stand-in."""
+    os.environ.setdefault('CIPHER_FAKE_GEMINI', '1')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from werkzeug.serving import make_server
+    import cipher_game
+
+    server = make_server('127.0.0.1', port, cipher_game.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True, name="loadtest-server").start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+def run(args) -> dict:
+    base_url = args.url
+    if args.spawn:
+        _, base_url = spawn_server(args.port)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import fake_gemini
+    concept_names = [c['name'] for c in fake_gemini.load_game_concepts()] or ["Firewall"]
+
+    results = Results()
+    stop_at = time.time() + args.duration
+    players = []
+    start = time.time()
+    for i in range(args.players):
+        player = VirtualPlayer(i, base_url, results, args, concept_names)
+        thread = threading.Thread(target=player.run, args=(stop_at, args.games), daemon=True, name=f"player-{i}")
+        thread.start()
+        players.append(thread)
+        if args.ramp:
+            time.sleep(args.ramp / args.players)
+    for thread in players:
+        thread.join()
+    return results.report(time.time() - start)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load-test the CIPHER Flask API with concurrent virtual players")
+    parser.add_argument('--url', default="http://127.0.0.1:5000")
+    parser.add_argument('--spawn', action='store_true', help="serve cipher_game.py in-process on fake_gemini")
+    parser.add_argument('--port', type=int, default=0, help="port for --spawn (0 = any free port)")
+    parser.add_argument('--players', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=30, help="seconds to keep starting games")
+    parser.add_argument('--games', type=int, default=0, help="games per player (0 = until --duration)")
+    parser.add_argument('--questions', type=int, default=8)
+    parser.add_argument('--hints', type=int, default=1)
+    parser.add_argument('--difficulties', nargs='+', default=["medium", "hard", "expert"])
+    parser.add_argument('--use-ai', action='store_true', help="start games with AI-generated concepts")
+    parser.add_argument('--stream', action='store_true', help="use the SSE question/guess endpoints")
+    parser.add_argument('--think-time', type=float, default=0.0, help="max random pause between actions (s)")
+    parser.add_argument('--ramp', type=float, default=0.0, help="seconds over which players are started")
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--seed', default="cipher")
+    parser.add_argument('--json', metavar='FILE', help="also write the report as JSON ('-' for stdout)")
+    args = parser.parse_args()
+
+    report = run(args)
+    print_table(report)
+    if args.json == '-':
+        print(json.dumps(report, indent=2))
+    elif args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)